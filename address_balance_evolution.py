@@ -2,11 +2,28 @@ import os
 import argparse
 import datetime
 import pandas as pd
-from pprint import pprint
-from itertools import cycle
-from collections import defaultdict
 import matplotlib.pyplot as plt
 import matplotlib.dates as mdates
+import numpy as np
+from balances import format_addresses, load_top_holders
+
+
+# turns the address/value column pairs of the top holders (the first N rows of each week) into an index
+# of (address, week, rank, balance) records sorted by address and week in one vectorized pass; returns
+# the addresses, the records and offsets such that records offsets[i]:offsets[i+1] are of addresses[i]
+def rank_index(address_df, value_df):
+    n_rows, n_weeks = address_df.shape
+    codes, uniques = pd.factorize(address_df.to_numpy().ravel(order='F'))
+    weeks = np.repeat(np.arange(n_weeks), n_rows)
+    ranks = np.tile(np.arange(n_rows), n_weeks)
+    balances = value_df.to_numpy(dtype=float).ravel(order='F')
+
+    # records are ordered by week already, hence a stable sort by address keeps them so for each address
+    keep = np.flatnonzero(codes >= 0)
+    keep = keep[np.argsort(codes[keep], kind='stable')]
+    records = pd.DataFrame({'week': weeks[keep], 'rank': ranks[keep], 'balance': balances[keep]})
+    offsets = np.searchsorted(codes[keep], np.arange(len(uniques) + 1))
+    return pd.Index(uniques), records, offsets
 
 
 formatter = lambda prog: argparse.RawTextHelpFormatter(prog, max_help_position=50)
@@ -57,12 +74,26 @@ args = parser.parse_args()
 DIR = os.path.join(args.dir, args.name)
 ASSETS_TYPE = 'tokens' if 'tokens' in DIR else 'coins'
 fname = [x for x in os.listdir(DIR) if 'addresses' in x][0]
-df = pd.read_csv(os.path.join(DIR, fname), header=0)
+if os.path.isdir(os.path.join(DIR, fname)):
+    # folder saved by main.py with --format=npy, of which only the first N rows are read
+    dates, values, ids, store_addresses = load_top_holders(os.path.join(DIR, fname))
+    ids = np.array(ids[:, :args.N]).T
+    address_df = pd.DataFrame(np.where(ids >= 0, format_addresses(store_addresses[np.maximum(ids, 0)]),
+        None), columns=dates)
+    value_df = pd.DataFrame(np.array(values[:, :args.N]).T, columns=dates)
+else:
+    df = pd.read_csv(os.path.join(DIR, fname), header=0)
+
+    # the last 2 * N_WEEKS columns are pairs of address and value columns, the address column being named
+    # after the date of the week
+    N_WEEKS = int(df.shape[-1] / 2)
+    pairs_df = df.iloc[:args.N, -2*N_WEEKS:]
+    address_df, value_df = pairs_df.iloc[:, 0::2], pairs_df.iloc[:, 1::2]
 
 #print(df.iloc[:N, -2:])
 #print()
 
-addresses = pd.Series(df.iloc[:args.N, -2:-1].iloc[:, -1]).to_list()
+addresses = address_df.iloc[:, -1].to_list()
 colors = ['blue', 'green', 'red', 'cyan', 'magenta', 'yellow', 'black', 'orange', 'lime', 'olive']
 markers = ['o', '+', 'x', 's', 'd', 'v', '8', 'p', '*', '1']
 while len(colors) < len(addresses):
@@ -76,50 +107,23 @@ am = dict(zip(addresses, markers))
 # pprint(addresses)
 #print()
 
-data = {}
 fig, ax = plt.subplots(figsize=(18, 10))
 
+uniques, records, offsets = rank_index(address_df, value_df)
+date = address_df.columns[0]
+
+for a, i in zip(addresses, uniques.get_indexer(addresses)):
+    a_records = records.iloc[offsets[i]:offsets[i+1]]
+    x = a_records['week'].to_numpy() + 1
+    y = a_records['balance'].to_numpy()
+    plt.plot(x, y, linestyle='', color=ac[a], label=a, marker=am[a], markersize=8)
 
-for c in range(int(df.shape[-1] / 2)):
-    left = -2 - 2*c
-    right = -1 - 2*c
-    date = df.iloc[:args.N, left:right].columns[0]
-    d = {}
-    for a in addresses:
-        try:
-            i = df.iloc[:args.N, left:right].loc[df.iloc[:args.N,
-                left:right].iloc[:, -1] == a].index[0]
-            v = df.iloc[:args.N, right:right+1 if right < -1 else df.shape[-1]].iloc[:, -1].iloc[i]
-            d[a] = v
-            plt.plot([int(df.shape[-1] / 2) - c], [v], color=ac[a], label=a if not c else None,
-                    marker=am[a], markersize=8)
-        except IndexError:
-            pass
-    data[date] = d
+    # connect values in consecutive weeks, i.e., while the address stays in the top N
+    for segment in np.split(np.arange(len(x)), np.flatnonzero(np.diff(x) > 1) + 1):
+        plt.plot(x[segment], y[segment], linestyle='-', linewidth=3, color=ac[a])
 print(date)
 date = datetime.datetime.strptime(date, '%Y-%m-%d')
 
-for a in addresses:
-    x = []
-    y = []
-    for i, k in enumerate(sorted(data.keys())):
-        try:
-            y.append(data[k][a])
-            x.append(i+1)
-            # x.append(date + datetime.timedelta(weeks=i+1))
-            # x.append(datetime.datetime.strptime(k, '%Y-%m-%d'))
-        except KeyError:
-            # print(x, i+1)
-            if x:
-                plt.plot(x, y, linestyle='-', linewidth=3, color=ac[a])
-                x = []
-                y = []
-            else:
-                pass
-    # x = [date + datetime.timedelta(weeks=w) for w in x]
-    # print(x)
-    plt.plot(x, y, linestyle='-', linewidth=3, color=ac[a])
-
 plt.title('Time evolution of top (at the last date) {} {} balances'.format(args.N, args.name),
         fontsize=16, fontweight='bold')
 
@@ -158,5 +162,4 @@ plt.yticks(fontsize=16)
 plt.legend()
 # plt.show()
 plt.savefig(os.path.join('evolution', '{}.pdf'.format(args.name)))
-# pprint(data)
 print('Done!')
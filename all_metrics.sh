@@ -1,11 +1 @@
-./metric.py --dir='data/tokens' --N=1000 --metric='entropy' --latex
-./metric.py --dir='data/tokens' --N=1000 --metric='gini' --latex
-./metric.py --dir='data/tokens' --N=1000 --metric='nakamoto' --latex
-./metric.py --dir='data/tokens' --N=1000 --metric='robin' --latex
-./metric.py --dir='data/tokens' --N=1000 --metric='efficiency' --latex
-
-./metric.py --dir='data/tokens' --N=10000 --metric='entropy' --latex
-./metric.py --dir='data/tokens' --N=10000 --metric='gini' --latex
-./metric.py --dir='data/tokens' --N=10000 --metric='nakamoto' --latex
-./metric.py --dir='data/tokens' --N=10000 --metric='robin' --latex
-./metric.py --dir='data/tokens' --N=10000 --metric='efficiency' --latex
+./metric.py --dir='data/tokens' --N 1000 10000 --metric entropy gini nakamoto robin efficiency --latex
@@ -0,0 +1,496 @@
+#!/usr/bin/env python3.9
+
+# This module contains the balance engine shared by main.py and calc_top_holders.py: addresses are
+# interned to dense integer IDs and balances are kept in a NumPy vector indexed by these IDs, so that
+# weekly accumulation is vectorized instead of looping over rows in Python. Addresses are kept as 20 raw
+# bytes rather than as 42-character strings, which are only formatted for output.
+
+import os
+import numpy as np
+import pandas as pd
+
+# raw token amounts are split into limbs of BASE_DIGITS decimal digits each, stored in int64; a limb of
+# a normalized balance is below BASE, hence billions of additions can be accumulated without overflow
+BASE_DIGITS = 9
+BASE = 10 ** BASE_DIGITS
+
+ADDRESS_DTYPE = np.dtype('S20')
+# values of hexadecimal digits by their ASCII codes (256 if not a digit), values of pairs of digits by
+# their two ASCII codes read as a little-endian uint16 (above 255 if either is not a digit), and digits
+# by their values
+NIBBLES = np.full(256, 256, dtype=np.uint16)
+for i, c in enumerate('0123456789abcdef'):
+    NIBBLES[ord(c)] = NIBBLES[ord(c.upper())] = i
+HEX_PAIRS = np.minimum(NIBBLES.reshape(1, -1) * 16 + NIBBLES.reshape(-1, 1), 256).ravel()
+HEX_PREFIX = ord('0') | ord('x') << 8
+HEX_DIGITS = np.frombuffer(b'0123456789abcdef', dtype=np.uint8)
+
+
+# parses addresses in format 0x followed by 40 hexadecimal digits into an array of 20 raw bytes each;
+# they are converted to 44 ASCII bytes, i.e., 22 pairs of digits, the last of which is zero unless an
+# address is too long
+def parse_addresses(addresses):
+    addresses = np.asarray(addresses)
+    try:
+        chars = addresses.astype('S44')
+    except UnicodeEncodeError:
+        address = next(a for a in addresses.ravel() if isinstance(a, str) and not a.isascii())
+        raise ValueError('Address \"{}\" is not a hexadecimal 20-byte address!'.format(address))
+    codes = chars.reshape(-1, 1).view('<u2')
+    raw = HEX_PAIRS[codes[:, 1:21]]
+    if codes.size and ((codes[:, 0] != HEX_PREFIX).any() or codes[:, 21].any() or raw.max() > 255):
+        row = np.argmax((codes[:, 0] != HEX_PREFIX) | (codes[:, 21] != 0) | (raw > 255).any(axis=1))
+        address = addresses.ravel()[row]
+        if pd.isna(address):
+            raise ValueError('Address is missing in row {} of {} rows!'.format(row, len(codes)))
+        raise ValueError('Address \"{}\" is not a hexadecimal 20-byte address!'.format(address))
+    return raw.astype(np.uint8).view(ADDRESS_DTYPE).reshape(chars.shape)
+
+
+# formats addresses parsed by parse_addresses() as strings of 0x followed by 40 hexadecimal digits; files
+# saved before addresses were kept as raw bytes hold them as such strings already
+def format_addresses(addresses):
+    addresses = np.asarray(addresses)
+    if addresses.dtype != ADDRESS_DTYPE:
+        return addresses.astype(str)
+    raw = np.ascontiguousarray(addresses).view(np.uint8).reshape(-1, 20)
+    chars = np.empty((len(raw), 42), dtype=np.uint8)
+    chars[:, 0], chars[:, 1] = ord('0'), ord('x')
+    chars[:, 2::2] = HEX_DIGITS[raw >> 4]
+    chars[:, 3::2] = HEX_DIGITS[raw & 15]
+    return chars.view('S42').reshape(addresses.shape).astype(str)
+
+
+# returns bytes 0-8, 8-16 and 16-20 of addresses (or only the first words of them) as big-endian
+# integers, which are ordered as the addresses, so that they can be sorted and searched as numbers
+# rather than as strings
+def address_words(addresses, words=3):
+    raw = np.ascontiguousarray(addresses, dtype=ADDRESS_DTYPE).view(np.uint8).reshape(-1, 20)
+    return [raw[:, begin:end].copy().view(dtype).ravel().astype(dtype[1:]) for begin, end, dtype in
+            [(0, 8, '>u8'), (8, 16, '>u8'), (16, 20, '>u4')][:words]]
+
+
+# returns codes of addresses (raw bytes) in order of their first appearance as pd.factorize() does,
+# positions of their first occurrences and the first words of addresses (see address_words()); addresses
+# are factorized by their first words, which is several times faster than by strings, unless different
+# addresses share them
+def factorize_addresses(addresses):
+    prefixes = address_words(addresses, words=1)[0]
+    for values in [prefixes, addresses.astype(object)]:
+        codes, uniques = pd.factorize(values)
+        first = np.full(len(uniques), len(codes))
+        np.minimum.at(first, codes, np.arange(len(codes)))
+        if not (addresses[first][codes] != addresses).any():
+            break
+    return codes, first, prefixes
+
+
+# maps addresses to dense integer IDs in order of their first appearance; instead of a dictionary of
+# address strings (about 150 bytes per address), the index is an array of sorted addresses (20 raw bytes
+# each) along with their IDs and their first 8 bytes as integers, which are searched first (56 bytes
+# per address in total)
+class AddressIndex:
+    def __init__(self, capacity=1024):
+        self._keys = np.zeros(0, dtype=ADDRESS_DTYPE)
+        self._prefixes = np.zeros(0, dtype=np.uint64)
+        self._key_ids = np.zeros(0, dtype=np.int64)
+        self._addresses = np.zeros(capacity, dtype=ADDRESS_DTYPE)
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    # addresses of IDs as raw bytes, see format_addresses()
+    @property
+    def addresses(self):
+        return self._addresses[:self._size]
+
+    # returns positions of (unique) keys among sorted addresses (where they would be inserted if not
+    # found) and whether they are found, given the order of their prefixes
+    def _search(self, keys, prefixes, order):
+        # searching sorted prefixes is several times faster, as each search narrows the next one
+        positions = np.empty(len(keys), dtype=np.int64)
+        positions[order] = np.searchsorted(self._prefixes, prefixes[order])
+        # with a unique prefix, a key is either the address of this prefix or next to it, while first 8
+        # bytes are hardly ever shared by different addresses, which are compared in full
+        following = np.minimum(positions + 1, len(self._prefixes) - 1)
+        candidates = np.flatnonzero(positions < len(self._prefixes))
+        shared = candidates[(following[candidates] > positions[candidates]) &
+                (self._prefixes[following[candidates]] == prefixes[candidates])]
+        unique = candidates[self._prefixes[positions[candidates]] == prefixes[candidates]]
+        positions[unique] += self._keys[positions[unique]] < keys[unique]
+        positions[shared] = np.searchsorted(self._keys, keys[shared])
+        found = np.zeros(len(keys), dtype=bool)
+        candidates = np.flatnonzero(positions < len(self._keys))
+        found[candidates] = self._keys[positions[candidates]] == keys[candidates]
+        return positions, found
+
+    def intern(self, addresses):
+        # addresses are parsed first, as it is faster to factorize them as raw bytes than as strings, and
+        # only unique ones are searched; the same address may be spelled with upper and lower case
+        # digits, which is the same address once parsed
+        keys = parse_addresses(addresses).ravel()
+        codes, first, prefixes = factorize_addresses(keys)
+        keys, prefixes = keys[first], prefixes[first]
+        order = np.argsort(prefixes)
+        positions, found = self._search(keys, prefixes, order)
+        ids = np.empty(len(keys), dtype=np.int64)
+        ids[found] = self._key_ids[positions[found]]
+
+        new = np.flatnonzero(~found)
+        if new.size:
+            # new addresses get IDs in order of their first appearance, and are inserted at once in order
+            # of their prefixes, or of all their bytes if any prefixes are shared
+            ids[new] = np.arange(self._size, self._size + new.size)
+            new = order[~found[order]]
+            if (prefixes[new[1:]] == prefixes[new[:-1]]).any():
+                new = new[np.lexsort(address_words(keys[new])[::-1])]
+            self._keys = np.insert(self._keys, positions[new], keys[new])
+            self._prefixes = np.insert(self._prefixes, positions[new], prefixes[new])
+            self._key_ids = np.insert(self._key_ids, positions[new], ids[new])
+
+            size = self._size + new.size
+            if size > self._addresses.size:
+                addresses = np.zeros(max(size, 2 * self._addresses.size), dtype=ADDRESS_DTYPE)
+                addresses[:self._size] = self._addresses[:self._size]
+                self._addresses = addresses
+            self._addresses[ids[new]] = keys[new]
+            self._size = size
+
+        return ids[codes]
+
+    def lookup(self, ids):
+        return format_addresses(self._addresses[ids]).tolist()
+
+
+# growable vector of balances indexed by address IDs
+class BalanceVector:
+    def __init__(self, capacity=1024, dtype=float):
+        self._values = np.zeros(capacity, dtype=dtype)
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    @property
+    def values(self):
+        return self._values[:self._size]
+
+    def _grow(self, size):
+        if size > self._values.size:
+            capacity = max(size, 2 * self._values.size)
+            values = np.zeros(capacity, dtype=self._values.dtype)
+            values[:self._size] = self._values[:self._size]
+            self._values = values
+        self._size = max(self._size, size)
+
+    def add(self, ids, values):
+        if not len(ids):
+            return
+        self._grow(int(ids.max()) + 1)
+        # np.add.at is unbuffered and applies values in row order, hence the balances are bit-identical
+        # to summing them one by one in a Python loop
+        np.add.at(self._values, ids, values)
+
+
+# parses (possibly negative) integer strings into a matrix of little-endian limbs, one row per value
+def parse_limbs(values, n_limbs=1):
+    values = np.asarray(values).astype(str)
+    if not values.size:
+        return np.zeros((0, n_limbs), dtype=np.int64)
+    negative = np.char.startswith(values, '-')
+    digits = np.char.lstrip(values, '-')
+    n_limbs = max(n_limbs, -(-int(np.char.str_len(digits).max()) // BASE_DIGITS))
+
+    width = n_limbs * BASE_DIGITS
+    # view the zero-padded fixed-width (UCS4) strings as a matrix of character codes
+    digits = np.char.zfill(digits, width).astype('U{}'.format(width)).view(np.uint32)
+    digits = digits.reshape(len(values), n_limbs, BASE_DIGITS) - ord('0')
+    limbs = digits.astype(np.int64) @ 10 ** np.arange(BASE_DIGITS - 1, -1, -1, dtype=np.int64)
+    limbs = np.ascontiguousarray(limbs[:, ::-1])
+    limbs[negative] *= -1
+    return limbs
+
+
+# converts limbs to token amounts as floats, the exact balance being rounded only here
+def limbs_to_float(limbs, decimals):
+    values = np.zeros(len(limbs))
+    for i in range(limbs.shape[1] - 1, -1, -1):
+        values = values * BASE + limbs[:, i]
+    return values / 10 ** decimals
+
+
+# exact counterpart of BalanceVector: balances are accumulated from raw integer token amounts (given as
+# strings) in fixed-point limbs, while values holds them converted to floats for ranking and output, so
+# that a zero balance is exactly zero
+class FixedPointBalanceVector:
+    def __init__(self, decimals, capacity=1024):
+        self.decimals = decimals
+        # one contiguous row per limb, which makes np.add.at much faster than on interleaved limbs
+        self._limbs = np.zeros((1, capacity), dtype=np.int64)
+        self._values = np.zeros(capacity)
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    @property
+    def values(self):
+        return self._values[:self._size]
+
+    @property
+    def limbs(self):
+        return self._limbs[:, :self._size].T
+
+    def _grow(self, size, n_limbs):
+        old_n_limbs, capacity = self._limbs.shape
+        if size > capacity or n_limbs > old_n_limbs:
+            capacity = max(size, 2 * capacity) if size > capacity else capacity
+            limbs = np.zeros((max(n_limbs, old_n_limbs), capacity), dtype=np.int64)
+            limbs[:old_n_limbs, :self._size] = self._limbs[:, :self._size]
+            self._limbs = limbs
+            values = np.zeros(capacity)
+            values[:self._size] = self._values[:self._size]
+            self._values = values
+        self._size = max(self._size, size)
+
+    def add(self, ids, values):
+        if not len(ids):
+            return
+        limbs = parse_limbs(values, self._limbs.shape[0])
+        self._grow(int(ids.max()) + 1, limbs.shape[1])
+        for i in range(limbs.shape[1]):
+            np.add.at(self._limbs[i], ids, limbs[:, i])
+
+        # propagate carries of the touched balances so that all limbs but the highest (signed) one are
+        # in [0, BASE) again
+        touched = pd.unique(ids)
+        limbs = self._limbs[:, touched].T
+        for i in range(limbs.shape[1] - 1):
+            carry = limbs[:, i] // BASE
+            limbs[:, i] -= carry * BASE
+            limbs[:, i + 1] += carry
+        self._limbs[:, touched] = limbs.T
+        self._values[touched] = limbs_to_float(limbs, self.decimals)
+
+
+# returns IDs and values of (at most) top largest balances in descending order; only positive balances
+# are considered unless nonzero is set, in which case all nonzero balances are (as in the original
+# dictionary-based code), ties being broken by address IDs (see HolderOrder for the order of the
+# original code)
+def top_balances(balances, top, nonzero=False):
+    values = balances.values
+    ids = np.flatnonzero(values != 0 if nonzero else values > 0)
+    candidates = values[ids]
+
+    if top < ids.size:
+        # select the top largest balances in linear time instead of sorting all holders; balances equal
+        # to the smallest selected one are taken in order of their IDs to keep the result deterministic
+        kth = candidates[np.argpartition(-candidates, top - 1)[top - 1]]
+        above = np.flatnonzero(candidates > kth)
+        ties = np.flatnonzero(candidates == kth)[:top - above.size]
+        selected = np.concatenate([above, ties])
+        ids = ids[selected]
+        candidates = candidates[selected]
+
+    order = np.lexsort((ids, -candidates))
+    return ids[order], candidates[order]
+
+
+# order of holders in the dictionary of the original code, which was sorted by balance (stably, hence
+# tied balances kept their previous order) and stripped of zero balances at every date, new holders being
+# appended in order of their first rows; top balances with addresses are ranked in this order, so that
+# tied balances are listed with the same addresses as before
+class HolderOrder:
+    def __init__(self):
+        self._order = np.zeros(0, dtype=np.int64)
+        self._listed = np.zeros(0, dtype=bool)
+
+    def touch(self, ids):
+        if not len(ids):
+            return
+        if int(ids.max()) >= self._listed.size:
+            listed = np.zeros(max(int(ids.max()) + 1, 2 * self._listed.size), dtype=bool)
+            listed[:self._listed.size] = self._listed
+            self._listed = listed
+        new = pd.unique(ids[~self._listed[ids]])
+        if new.size:
+            self._listed[new] = True
+            self._order = np.concatenate([self._order, new])
+
+    # returns IDs and values of (at most) top largest nonzero balances like top_balances(); holders are
+    # sorted in full, which is fast as their order hardly changes between dates
+    def top(self, balances, top):
+        values = balances.values[self._order]
+        order = np.argsort(-values, kind='stable')
+        ids, values = self._order[order], values[order]
+        nonzero = values != 0
+        self._listed[ids[~nonzero]] = False
+        self._order = ids[nonzero]
+        return self._order[:top], values[nonzero][:top]
+
+
+# weekly top balances (and addresses) written into preallocated matrices, one column per week, so that
+# the output frame is materialized only once at the end instead of being concatenated every week
+class TopHoldersMatrix:
+    def __init__(self, top, num_weeks, keep_address=False):
+        self.values = np.full((top, num_weeks), np.nan)
+        self.addresses = np.full((top, num_weeks), np.nan, dtype=object) if keep_address else None
+        self.dates = []
+        self._rows = 0
+
+    def __len__(self):
+        return len(self.dates)
+
+    # changes the number of preallocated weeks, e.g., when new data arrives after a checkpoint
+    def resize(self, num_weeks):
+        assert num_weeks >= len(self.dates)
+        top, old_num_weeks = self.values.shape
+        values = np.full((top, num_weeks), np.nan)
+        values[:, :min(num_weeks, old_num_weeks)] = self.values[:, :num_weeks]
+        self.values = values
+        if self.addresses is not None:
+            addresses = np.full((top, num_weeks), np.nan, dtype=object)
+            addresses[:, :min(num_weeks, old_num_weeks)] = self.addresses[:, :num_weeks]
+            self.addresses = addresses
+
+    def append(self, date, values, addresses=None):
+        week = len(self.dates)
+        self.values[:len(values), week] = values
+        if self.addresses is not None:
+            self.addresses[:len(values), week] = addresses
+        self.dates.append(date)
+        self._rows = max(self._rows, len(values))
+
+    def to_frame(self):
+        # the index only spans the longest week, as it did with pd.concat
+        values = self.values[:self._rows, :len(self.dates)]
+        if self.addresses is None:
+            return pd.DataFrame(values, columns=self.dates)
+
+        columns = []
+        names = []
+        for week, date in enumerate(self.dates):
+            columns += [self.addresses[:self._rows, week], values[:, week]]
+            names += [date, '']
+        df = pd.DataFrame(dict(enumerate(columns)))
+        df.columns = names
+        return df
+
+
+# binary alternative to TopHoldersMatrix: top balances of each period are written to {dir}/values.npy
+# (periods x top, NaN if there are fewer holders) and, with keep_address, IDs of their addresses to
+# {dir}/ids.npy (-1 if none) as soon as they are calculated, both files being preallocated and memory
+# mapped; dates.npy and addresses.npy (mapping IDs to addresses) are saved by close(). The first top
+# balances of any period can hence be read without parsing anything, see load_top_holders(). Rows of
+# previous runs (dates, values and ids) are copied to the new files if given
+class TopHoldersStore:
+    def __init__(self, dir_, top, num_periods, keep_address=False, previous=None):
+        if not os.path.isdir(dir_):
+            os.makedirs(dir_)
+        self.dir = dir_
+        self.values = np.lib.format.open_memmap(os.path.join(dir_, 'values.npy'), mode='w+', dtype=float,
+                shape=(num_periods, top))
+        self.values[:] = np.nan
+        self.ids = None
+        if keep_address:
+            self.ids = np.lib.format.open_memmap(os.path.join(dir_, 'ids.npy'), mode='w+',
+                    dtype=np.int32, shape=(num_periods, top))
+            self.ids[:] = -1
+        self.dates = []
+        if previous is not None:
+            dates, values, ids = previous
+            self.dates = list(dates)
+            self.values[:len(dates)] = values
+            if self.ids is not None:
+                self.ids[:len(dates)] = ids
+
+    def __len__(self):
+        return len(self.dates)
+
+    def append(self, date, values, ids=None):
+        period = len(self.dates)
+        self.values[period, :len(values)] = values
+        if self.ids is not None:
+            self.ids[period, :len(ids)] = ids
+        self.dates.append(date)
+
+    def close(self, addresses=None):
+        self.values.flush()
+        np.save(os.path.join(self.dir, 'dates.npy'), np.array(self.dates, dtype='S'))
+        if self.ids is not None:
+            self.ids.flush()
+            np.save(os.path.join(self.dir, 'addresses.npy'), np.array(addresses, dtype='S'))
+
+
+# returns dates (as strings), top balances and IDs of their addresses (periods x top, memory mapped) and
+# the addresses of IDs (memory mapped bytes) saved by TopHoldersStore; the last two are None unless the
+# addresses were kept
+def load_top_holders(dir_):
+    dates = np.load(os.path.join(dir_, 'dates.npy')).astype(str)
+    values = np.load(os.path.join(dir_, 'values.npy'), mmap_mode='r')[:len(dates)]
+    if not os.path.isfile(os.path.join(dir_, 'ids.npy')):
+        return dates, values, None, None
+    return dates, values, np.load(os.path.join(dir_, 'ids.npy'), mmap_mode='r')[:len(dates)], \
+            np.load(os.path.join(dir_, 'addresses.npy'), mmap_mode='r')
+
+
+# log of balances at the end of each period for the addresses whose balances changed in it, which allows
+# to get the history of any address (not only of top holders); see load_address_history()
+class BalanceHistory:
+    def __init__(self):
+        self._touched = []
+        self._ids = []
+        self._periods = []
+        self._balances = []
+
+    def touch(self, ids):
+        self._touched.append(ids)
+
+    def close_period(self, period, balances):
+        if self._touched:
+            ids = pd.unique(np.concatenate(self._touched))
+            self._ids.append(ids)
+            self._periods.append(np.full(len(ids), period, dtype=np.int32))
+            self._balances.append(balances.values[ids])
+        self._touched = []
+
+    # saves records sorted by address (and by period for each address) along with sorted addresses and
+    # offsets of their records, so that the history of an address is a contiguous slice
+    def save(self, dir_, addresses, dates):
+        if not os.path.isdir(dir_):
+            os.makedirs(dir_)
+        addresses = np.array(addresses, dtype='S')
+        order = np.argsort(addresses, kind='stable')
+        position = np.empty(len(addresses), dtype=np.int64)
+        position[order] = np.arange(len(addresses))
+
+        ids = np.concatenate(self._ids) if self._ids else np.zeros(0, dtype=np.int64)
+        keys = position[ids]
+        records = np.argsort(keys, kind='stable')
+        offsets = np.concatenate([[0], np.cumsum(np.bincount(keys, minlength=len(addresses)))])
+
+        np.save(os.path.join(dir_, 'addresses.npy'), addresses[order])
+        np.save(os.path.join(dir_, 'offsets.npy'), offsets)
+        np.save(os.path.join(dir_, 'periods.npy'), np.concatenate(self._periods)[records] if self._ids
+                else np.zeros(0, dtype=np.int32))
+        np.save(os.path.join(dir_, 'balances.npy'), np.concatenate(self._balances)[records] if
+                self._ids else np.zeros(0))
+        np.save(os.path.join(dir_, 'dates.npy'), np.array(dates, dtype='S'))
+
+
+# returns balances of an address at the ends of periods in which it changed, indexed by dates, reading
+# only its records from the memory mapped history saved by BalanceHistory
+def load_address_history(dir_, address):
+    load = lambda name: np.load(os.path.join(dir_, name + '.npy'), mmap_mode='r')
+    addresses = load('addresses')
+    address = address.lower()
+    key = parse_addresses([address])[0] if addresses.dtype == ADDRESS_DTYPE else address.encode()
+    i = int(np.searchsorted(addresses, key))
+    if i == len(addresses) or addresses[i] != key:
+        raise KeyError('Address \"{}\" is not found in \"{}\"!'.format(address, dir_))
+
+    offsets = load('offsets')
+    begin, end = offsets[i], offsets[i+1]
+    dates = load('dates')[load('periods')[begin:end]].astype(str)
+    return pd.Series(np.array(load('balances')[begin:end]), index=dates, name=address)
@@ -0,0 +1,116 @@
+#!/usr/bin/env python3.9
+
+# This script can be used to calculate weekly top N ERC20 token balances for all tokens in a directory
+# at once, running main.py for several tokens in parallel.
+
+import os
+import sys
+import argparse
+import traceback
+import contextlib
+import pandas as pd
+from time import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import main as pipeline
+
+
+# total size of CSV files of a token, used to schedule the largest tokens first
+def csv_size(csv_dir):
+    return sum(os.path.getsize(os.path.join(csv_dir, f)) for f in os.listdir(csv_dir) if
+            os.path.isfile(os.path.join(csv_dir, f)))
+
+
+# runs main.py for one token in a worker process, its output being redirected to a log file; invalid
+# arguments of main.py (which exits via argparse) fail the token rather than the worker
+def run(dir_, name, main_args):
+    start = time()
+    with open(os.path.join(dir_, name, 'main.log'), 'w') as f, contextlib.redirect_stdout(f), \
+            contextlib.redirect_stderr(f):
+        try:
+            pipeline.main(['--dir', dir_, '--name', name] + main_args)
+            status = 'done'
+        except (Exception, SystemExit):
+            traceback.print_exc(file=f)
+            status = 'failed'
+    return name, status, time() - start
+
+
+def main():
+    formatter = lambda prog: argparse.RawTextHelpFormatter(prog, max_help_position=50)
+    parser = argparse.ArgumentParser(
+            description='Calculates weekly top token holders for all ERC20 tokens in a directory using a\n'
+                'pool of processes. Unknown arguments (e.g., --top, --keep_address) are passed to\n'
+                'main.py',
+            add_help=False,
+            formatter_class=formatter,
+            )
+
+    # required arguments
+    required_args = parser.add_argument_group('required arguments')
+    required_args.add_argument(
+            '--dir',
+            type=str,
+            required=True,
+            help='Path to parent directory with ERC20 tokens data',
+            )
+
+    # optimal arguments
+    optional_args = parser.add_argument_group('optional arguments')
+    optional_args.add_argument(
+            '-h',
+            '--help',
+            action='help',
+            help='show this help message and exit',
+            )
+    optional_args.add_argument(
+            '--workers',
+            type=int,
+            default=os.cpu_count(),
+            help='Number of worker processes, defaults to the number of CPUs',
+            )
+    optional_args.add_argument(
+            '--names',
+            type=str,
+            nargs='+',
+            default=None,
+            help='Names of ERC20 tokens to process, defaults to all folders with CSV files',
+            )
+    args, main_args = parser.parse_known_args()
+
+    if not os.path.isdir(args.dir):
+        raise FileNotFoundError('Directory \"{}\" does not exist!'.format(args.dir))
+
+    names = args.names if args.names is not None else \
+            [n for n in os.listdir(args.dir) if os.path.isdir(os.path.join(args.dir, n, 'csv'))]
+    if not names:
+        raise FileNotFoundError('Directory \"{}\" contains no tokens with CSV files! Please download '
+                'data from GCS'.format(args.dir))
+
+    # longest job first, so that the largest tokens do not start last and delay the whole batch
+    sizes = {name: csv_size(os.path.join(args.dir, name, 'csv')) for name in names}
+    names.sort(key=lambda name: sizes[name], reverse=True)
+
+    print('Calculating top token holders for {} tokens using {} workers...'.format(len(names),
+        args.workers))
+    start = time()
+    summary = []
+    with ProcessPoolExecutor(max_workers=args.workers) as executor:
+        futures = [executor.submit(run, args.dir, name, main_args) for name in names]
+        for future in as_completed(futures):
+            name, status, elapsed = future.result()
+            summary.append({'name': name, 'csv_bytes': sizes[name], 'status': status,
+                'elapsed_s': elapsed})
+            print(' {}: {} in {:.4f} s (log saved in {})'.format(name, status, elapsed,
+                os.path.join(args.dir, name, 'main.log')))
+
+    fname = os.path.join(args.dir, 'batch_summary.csv')
+    summary = pd.DataFrame(summary).sort_values('csv_bytes', ascending=False)
+    summary.to_csv(fname, index=False)
+    print('Elapsed time: {:.4f} s'.format(time() - start))
+    print('Summary saved in {}'.format(fname))
+    if (summary['status'] != 'done').any():
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
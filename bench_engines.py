@@ -0,0 +1,90 @@
+#!/usr/bin/env python3.9
+
+# This script can be used to compare the throughput of the float and the exact (fixed-point) balance
+# engines of main.py on the same randomly generated raw token amounts.
+
+import argparse
+import numpy as np
+from time import time
+from balances import BalanceVector, FixedPointBalanceVector
+
+
+def main():
+    formatter = lambda prog: argparse.RawTextHelpFormatter(prog, max_help_position=50)
+    parser = argparse.ArgumentParser(
+            description='Compares throughput of the float and the exact balance engines',
+            add_help=False,
+            formatter_class=formatter,
+            )
+
+    # optimal arguments
+    optional_args = parser.add_argument_group('optional arguments')
+    optional_args.add_argument(
+            '-h',
+            '--help',
+            action='help',
+            help='show this help message and exit',
+            )
+    optional_args.add_argument(
+            '--rows',
+            type=int,
+            default=1000000,
+            help='Number of rows (balance changes) to accumulate, defaults to 1000000',
+            )
+    optional_args.add_argument(
+            '--holders',
+            type=int,
+            default=100000,
+            help='Number of distinct holders, defaults to 100000',
+            )
+    optional_args.add_argument(
+            '--chunk',
+            type=int,
+            default=100000,
+            help='Number of rows accumulated at once (e.g., in one week), defaults to 100000',
+            )
+    optional_args.add_argument(
+            '--decimals',
+            type=int,
+            default=18,
+            help='Decimals of ERC20 token, defaults to 18',
+            )
+    optional_args.add_argument(
+            '--seed',
+            type=int,
+            default=0,
+            help='Seed of random number generator, defaults to 0',
+            )
+    args = parser.parse_args()
+
+    # raw amounts of up to 10^(decimals + 6) base units, i.e., up to a million tokens per transfer
+    rng = np.random.default_rng(args.seed)
+    ids = rng.integers(0, args.holders, args.rows)
+    mantissa = rng.integers(1, 10 ** 9, args.rows)
+    exponent = rng.integers(0, args.decimals - 2, args.rows)
+    sign = np.where(rng.random(args.rows) < 0.5, '-', '')
+    raw = np.char.add(sign, np.char.add(mantissa.astype(str), np.char.multiply('0', exponent)))
+    raw = raw.astype(object)
+    print('Generated {} rows for {} holders'.format(args.rows, args.holders))
+
+    results = {}
+    for name in ['float', 'exact']:
+        balances = BalanceVector() if name == 'float' else FixedPointBalanceVector(args.decimals)
+        start = time()
+        for i in range(0, args.rows, args.chunk):
+            chunk = raw[i:i+args.chunk]
+            if name == 'float':
+                chunk = chunk.astype(float) / 10 ** args.decimals
+            balances.add(ids[i:i+args.chunk], chunk)
+        elapsed = time() - start
+        results[name] = balances.values.copy()
+        print('{:>5}: {:.4f} s, {:.0f} rows/s'.format(name, elapsed, args.rows / elapsed))
+
+    error = np.abs(results['float'] - results['exact'])
+    print('Max absolute difference between engines: {}'.format(error.max()))
+    print('Balances that are nonzero for the float engine only: {}'.format(
+        np.count_nonzero((results['float'] != 0) & (results['exact'] == 0))))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,216 @@
+#!/usr/bin/env python3.9
+
+# This script can be used to benchmark the pipeline of this repository on synthetic data generated by
+# synthetic_transfers.py at several scales: each stage (generating CSV files, split_csv.py,
+# calc_top_holders.py and main.py) is run in its own process, whose elapsed time, throughput (rows/s)
+# and peak resident memory are saved in a JSON file.
+
+import os
+import re
+import sys
+import json
+import shutil
+import argparse
+import platform
+import datetime
+import subprocess
+from time import time
+from transfers import WEEKDAYS
+
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+STAGES = ['generate', 'split_csv', 'calc_top_holders', 'main']
+
+
+# runs a script of this repository in a child process writing its output to log; returns the elapsed
+# time, the peak resident memory of the child in megabytes and its exit code
+def run_stage(script, args, log):
+    cmd = [sys.executable, os.path.join(SCRIPTS_DIR, script)] + args
+    start = time()
+    with open(log, 'w') as f:
+        f.write(' '.join(cmd) + '\n')
+        f.flush()
+        process = subprocess.Popen(cmd, stdout=f, stderr=subprocess.STDOUT)
+        # unlike Popen.wait(), wait4() also returns resource usage of the child
+        _, status, rusage = os.wait4(process.pid, 0)
+    elapsed = time() - start
+    process.returncode = os.waitstatus_to_exitcode(status)
+    # ru_maxrss is in kilobytes on Linux but in bytes on macOS
+    peak_rss = rusage.ru_maxrss / (1024 ** 2 if sys.platform == 'darwin' else 1024)
+    return elapsed, peak_rss, process.returncode
+
+
+def main():
+    formatter = lambda prog: argparse.RawTextHelpFormatter(prog, max_help_position=50)
+    parser = argparse.ArgumentParser(
+            description='Benchmarks the stages of the pipeline on synthetic ERC20 token transfers',
+            add_help=False,
+            formatter_class=formatter,
+            )
+
+    # required arguments
+    required_args = parser.add_argument_group('required arguments')
+    required_args.add_argument(
+            '--dir',
+            type=str,
+            required=True,
+            help='Path to directory for synthetic tokens data (one folder per scale)',
+            )
+
+    # optimal arguments
+    optional_args = parser.add_argument_group('optional arguments')
+    optional_args.add_argument(
+            '-h',
+            '--help',
+            action='help',
+            help='show this help message and exit',
+            )
+    optional_args.add_argument(
+            '--rows',
+            type=int,
+            nargs='+',
+            default=[1000000, 10000000, 100000000],
+            help='Numbers of rows of synthetic tokens, defaults to 1000000 10000000 100000000',
+            )
+    optional_args.add_argument(
+            '--stages',
+            type=str,
+            nargs='+',
+            choices=STAGES,
+            default=STAGES,
+            help='Stages to benchmark (data is generated if missing even if \"generate\" is not\n'
+                'given), defaults to all of them: {}'.format(', '.join(STAGES)),
+            )
+    optional_args.add_argument(
+            '--output',
+            type=str,
+            default='benchmark.json',
+            help='Path to JSON file with results, defaults to benchmark.json',
+            )
+    optional_args.add_argument(
+            '--days',
+            type=int,
+            default=365,
+            help='Age of synthetic tokens in days, defaults to 365',
+            )
+    optional_args.add_argument(
+            '--holders',
+            type=int,
+            default=1000000,
+            help='Number of holders of synthetic tokens, defaults to 1000000',
+            )
+    optional_args.add_argument(
+            '--top',
+            type=int,
+            default=10000,
+            help='How many top holders to consider, defaults to 10000',
+            )
+    optional_args.add_argument(
+            '--format',
+            type=str,
+            choices=['pkl', 'npy'],
+            default='npy',
+            help='Format of weekly data saved by split_csv.py, defaults to npy',
+            )
+    optional_args.add_argument(
+            '--seed',
+            type=int,
+            default=0,
+            help='Seed of random number generator, defaults to 0',
+            )
+    optional_args.add_argument(
+            '--rm',
+            action='store_true',
+            default=False,
+            help='Remove data of a scale after benchmarking it, defaults to False'
+            )
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.dir):
+        os.makedirs(args.dir)
+
+    # dates of synthetic tokens are known in advance, so that stages can also be run separately
+    START_DATE = datetime.datetime(2020, 1, 1)
+    END_DATE = START_DATE + datetime.timedelta(days=args.days - 1)
+    # main.py calculates top balances on the same weekday as split_csv.py ends weeks on
+    WEEKDAY = WEEKDAYS[END_DATE.weekday()]
+    END_DATE = END_DATE.strftime('%Y-%m-%d')
+
+    results = []
+    for rows in args.rows:
+        name = 'synthetic_{}'.format(rows)
+        DIR = os.path.join(args.dir, name)
+        CSV_DIR = os.path.join(DIR, 'csv')
+        log = lambda stage: os.path.join(DIR, 'benchmark_{}.log'.format(stage))
+
+        stage_args = {
+                'generate': ['--dir', args.dir, '--name', name, '--rows', str(rows), '--days',
+                    str(args.days), '--holders', str(args.holders), '--seed', str(args.seed),
+                    '--start_date', START_DATE.strftime('%Y-%m-%d')],
+                'split_csv': ['--dir', args.dir, '--name', name, '--end_date', END_DATE, '--format',
+                    args.format],
+                'calc_top_holders': ['--dir', args.dir, '--name', name, '--top', str(args.top),
+                    '--end_date', END_DATE, '--format', args.format],
+                'main': ['--dir', args.dir, '--name', name, '--top', str(args.top), '--weekday',
+                    WEEKDAY],
+                }
+        scripts = {stage: '{}.py'.format('synthetic_transfers' if stage == 'generate' else stage)
+                for stage in STAGES}
+
+        stages = list(args.stages)
+        if 'generate' in stages or not (os.path.isdir(CSV_DIR) and os.listdir(CSV_DIR)):
+            if os.path.isdir(DIR):
+                shutil.rmtree(DIR)
+            os.makedirs(DIR)
+            if 'generate' not in stages:
+                stages.insert(0, 'generate')
+        # calc_top_holders.py needs weekly data saved by split_csv.py
+        if 'calc_top_holders' in stages and 'split_csv' not in stages and not os.path.isdir(
+                os.path.join(DIR, args.format)):
+            stages.insert(stages.index('calc_top_holders'), 'split_csv')
+
+        for stage in STAGES:
+            if stage not in stages:
+                continue
+            if stage == 'calc_top_holders':
+                # the start date to use is printed by split_csv.py
+                with open(log('split_csv'), 'r') as f:
+                    match = re.search(r'Use "(\d{4}-\d{2}-\d{2})" as start_date', f.read())
+                if match is None:
+                    raise ValueError('Start date is not found in \"{}\"!'.format(log('split_csv')))
+                stage_args[stage] += ['--start_date', match.group(1)]
+
+            print('Running {} on {} rows...'.format(stage, rows))
+            elapsed, peak_rss, returncode = run_stage(scripts[stage], stage_args[stage], log(stage))
+            results.append({
+                'stage': stage,
+                'rows': rows,
+                'seconds': elapsed,
+                'rows_per_s': rows / elapsed,
+                'peak_rss_mb': peak_rss,
+                'returncode': returncode,
+                })
+            print(' {:.4f} s, {:.0f} rows/s, peak RSS {:.1f} MB'.format(elapsed, rows / elapsed,
+                peak_rss))
+            if returncode:
+                print(' {} failed with exit code {}, see {}'.format(stage, returncode, log(stage)))
+                break
+
+        if args.rm:
+            shutil.rmtree(DIR)
+
+        # results are saved after every scale, so that they are kept if a larger one fails
+        with open(args.output, 'w') as f:
+            json.dump({
+                'created': datetime.datetime.now().isoformat(timespec='seconds'),
+                'python': platform.python_version(),
+                'platform': platform.platform(),
+                'cpus': os.cpu_count(),
+                'settings': {'days': args.days, 'holders': args.holders, 'top': args.top,
+                    'format': args.format, 'seed': args.seed},
+                'results': results,
+                }, f, indent=4)
+    print('Results saved in {}'.format(args.output))
+
+
+if __name__ == '__main__':
+    main()
@@ -11,9 +11,14 @@ import gc
 import pickle
 import argparse
 import datetime
-import pandas as pd
 from time import time
-from collections import defaultdict
+from balances import AddressIndex, BalanceVector, HolderOrder, TopHoldersMatrix, format_addresses, \
+        top_balances
+from transfers import count_weeks, load_addresses, load_week
+from instrumentation import Instrumentation
+
+# stages timed with --stats, any of which can be profiled with --profile
+STAGES = ['parse', 'accumulate', 'top', 'concat', 'write']
 
 
 def main():
@@ -83,81 +88,115 @@ def main():
             default=False,
             help='Keep address along with its values, defaults to False'
             )
+    optional_args.add_argument(
+            '--format',
+            type=str,
+            choices=['pkl', 'npy'],
+            default='pkl',
+            help='Format of weekly data saved by split_csv.py, defaults to pkl',
+            )
+    optional_args.add_argument(
+            '--stats',
+            type=str,
+            default=None,
+            help='Append timings of stages, rows, holders and peak memory of every week\n'
+                'as JSON lines to this file, defaults to None',
+            )
+    optional_args.add_argument(
+            '--profile',
+            type=str,
+            choices=STAGES,
+            default=None,
+            help='Profile this stage by cProfile (saved next to --stats), defaults to None',
+            )
     args = parser.parse_args()
+    stats = Instrumentation('calc_top_holders', args.stats, args.profile)
     
     DIR = os.path.join(args.dir, args.name)
     if not os.path.isdir(DIR):
         raise FileNotFoundError('Directory \"{}\" does not exist! Please download data from GCS'.\
                 format(DIR))
     
-    PKL_DIR = os.path.join(DIR, 'pkl')
+    PKL_DIR = os.path.join(DIR, args.format)
     if not os.path.isdir(PKL_DIR):
         raise FileNotFoundError('Directory \"{}\" does not exist! Please split CSV files'.\
                 format(PKL_DIR))
     
     PKL_FILES = os.listdir(PKL_DIR)
     if not PKL_FILES:
-        raise FileNotFoundError('Directory \"{}\" contains no pickle files! Please split CSV files'.\
-                format(PKL_DIR))
+        raise FileNotFoundError('Directory \"{}\" contains no {} files! Please split CSV files'.\
+                format(PKL_DIR, 'pickle' if args.format == 'pkl' else 'NumPy'))
     PKL_FILES = list(sorted(PKL_FILES))
-    N_FILES = len(PKL_FILES)
+    N_FILES = len(PKL_FILES) if args.format == 'pkl' else count_weeks(PKL_DIR)
     
     START_DATE = datetime.datetime.strptime(args.start_date, '%Y-%m-%d')
     DELTA = datetime.timedelta(weeks=1)
 
     date = START_DATE + DELTA
-    tokens = defaultdict(float)
-    main_df = pd.DataFrame()
+    address_index = AddressIndex()
+    balances = BalanceVector()
+    # tied balances are listed with addresses in the order of the original code
+    order = HolderOrder() if args.keep_address else None
+    if args.format == 'npy':
+        # weeks are already dictionary-encoded by split_csv.py, so addresses are not interned here
+        addresses = load_addresses(PKL_DIR)
+        lookup = lambda ids: format_addresses(addresses[ids]).tolist()
+    else:
+        lookup = address_index.lookup
+    top_holders = TopHoldersMatrix(args.top, N_FILES, keep_address=args.keep_address)
 
     print('Calculating top token holders for \"{}\"...'.format(args.name))
     start = time()
-    for i, file_ in enumerate(PKL_FILES):
+    for i in range(N_FILES):
         if args.verbose:
             print(' file {} out of {}'.format(i, N_FILES - 1), end='\r')
 
-        fname = os.path.join(PKL_DIR, file_)
-        f = open(fname, 'rb')
-        gc.disable()
-        df = pickle.load(f)
-        gc.enable()
-        f.close()
-
-        z1 = zip(*df.to_dict('list').values())
-        for address, value in z1:
-            tokens[address] += value
-
+        with stats.stage('parse'):
+            if args.format == 'pkl':
+                fname = os.path.join(PKL_DIR, PKL_FILES[i])
+                f = open(fname, 'rb')
+                gc.disable()
+                df = pickle.load(f)
+                gc.enable()
+                f.close()
+                ids = address_index.intern(df['address'].to_numpy())
+                values = df['value'].to_numpy()
+            else:
+                ids, values = load_week(PKL_DIR, i)
 
-        if args.keep_address:
-            tokens = defaultdict(float, {k: v for k, v in sorted(tokens.items(), reverse=True, 
-                key=lambda item: item[1]) if v})
-            sorted_d_len = len(tokens)
-        else:
-            sorted_d = [t for t in tokens.values() if t]
-            sorted_d.sort(reverse=True)
-            sorted_d_len = len(sorted_d)
+        with stats.stage('accumulate'):
+            balances.add(ids, values)
+            if order is not None:
+                order.touch(ids)
 
-        cut = args.top if sorted_d_len >= args.top else sorted_d_len
-        
-        if not args.keep_address:
-            df = pd.DataFrame({date.strftime('%Y-%m-%d'): sorted_d[:cut]})
-        else:
-            df = pd.DataFrame({date.strftime('%Y-%m-%d'): list(tokens.keys())[:cut]})
-            df = pd.concat([df, pd.DataFrame({'': list(tokens.values())[:cut]})], axis=1)
-        main_df = pd.concat([main_df, df], axis=1)
+        # unlike main.py, nonzero (rather than only positive) balances are ranked here in both modes
+        with stats.stage('top'):
+            top_ids, top_values = order.top(balances, args.top) if order is not None else \
+                    top_balances(balances, args.top, nonzero=True)
+        with stats.stage('concat'):
+            top_holders.append(date.strftime('%Y-%m-%d'), top_values,
+                    lookup(top_ids) if args.keep_address else None)
+        stats.period(date.strftime('%Y-%m-%d'), len(ids), balances)
         # print(main_df)
         # exit()
         date += DELTA
 
     print(' ' * 50, end='\r')
     print('Calculating done! Saving data...')
-    assert main_df.shape[1] == N_FILES if not args.keep_address else N_FILES / 2
+    assert len(top_holders) == N_FILES
+    with stats.stage('concat'):
+        main_df = top_holders.to_frame()
     fname = os.path.join(DIR, 'top{}_token_holders'.format(args.top) + \
             '_addresses' * args.keep_address + '.csv')
-    main_df.to_csv(fname)
+    with stats.stage('write'):
+        main_df.to_csv(fname)
+    stats.close()
     if args.verbose:
         print(main_df.iloc[:20, :])
     print('Elapsed time: {:.4f} s'.format(time() - start))
     print('Data saved in {}'.format(fname))
+    if args.stats is not None:
+        print('Stats saved in {}'.format(args.stats))
 
 
 if __name__ == '__main__':
@@ -0,0 +1,31 @@
+-- This query can be used to extract the data (until END_DATE exclusively) from ERC20 token transfers of
+-- several tokens at once, and save the results to CSV files on Google Cloud Storage (GCS). As in
+-- extract2csv_transfers.sql, each transfer is exported once with both of its addresses and its raw
+-- integer amount, along with the address of its token, so that main.py calculates top balances of all
+-- of the tokens in one pass over the files (use --tokens with a CSV file listing the addresses, names and
+-- decimals of the tokens, such as tokens.csv).
+-- As an example, here we extract data for SushiToken, Uniswap and ChainLink
+-- https://etherscan.io/token/0x6b3595068778dd592e39a122f4f5a5cf09c90fe2
+-- https://etherscan.io/token/0x1f9840a85d5af5bf1d1762f925bdaddc4201f984
+-- https://etherscan.io/token/0x514910771af9ca656af840dff83e8264ecf986ca
+
+#standardSQL
+
+DECLARE TARGET_TOKEN_ADDRESSES ARRAY<STRING>;
+DECLARE END_DATE DATE;
+
+-- Set addresses (can be found on Etherscan), and the end date of token transfers for
+-- the tokens of interest
+SET TARGET_TOKEN_ADDRESSES = ["0x6b3595068778dd592e39a122f4f5a5cf09c90fe2", "0x1f9840a85d5af5bf1d1762f925bdaddc4201f984", "0x514910771af9ca656af840dff83e8264ecf986ca"];
+SET END_DATE = DATE("2022-01-17"); --exclusively
+
+EXPORT DATA OPTIONS(
+    uri='gs://my_bucket/my_folder/*.csv', -- make sure to change the path to your bucket and folder
+    format='CSV',
+    overwrite=TRUE,
+    header=TRUE,
+    field_delimiter=',') AS
+SELECT FORMAT_DATE("%Y-%m-%d", tt.block_timestamp) AS block_date, tt.token_address AS token_address, tt.from_address AS from_address, tt.to_address AS to_address, tt.value AS value
+FROM `bigquery-public-data.crypto_ethereum.token_transfers` AS tt
+WHERE (tt.from_address IS NOT NULL OR tt.to_address IS NOT NULL) AND SAFE_CAST(tt.value AS FLOAT64) > 0 AND tt.token_address IN UNNEST(TARGET_TOKEN_ADDRESSES) AND DATE(tt.block_timestamp) < END_DATE
+ORDER BY block_date ASC
@@ -0,0 +1,29 @@
+-- This query can be used to extract the data (until END_DATE exclusively) from ERC20 token transfers,
+-- and save the results to CSV files on Google Cloud Storage (GCS). Unlike extract2csv.sql, each transfer
+-- is exported once (rather than as a row for the receiver and a row for the sender), along with both of
+-- its addresses and its raw integer amount (not divided by 10^DECIMALS), which halves the number of
+-- rows to be downloaded and parsed by main.py (use --decimals=DECIMALS, and --exact to accumulate the
+-- amounts exactly).
+-- As an example, here we extract data for SushiToken
+-- https://etherscan.io/token/0x6b3595068778dd592e39a122f4f5a5cf09c90fe2
+
+#standardSQL
+
+DECLARE TARGET_TOKEN_ADDRESS STRING;
+DECLARE END_DATE DATE;
+
+-- Set address (can be found on Etherscan), and the end date of token transfers for
+-- the token of interest
+SET TARGET_TOKEN_ADDRESS = "0x6b3595068778dd592e39a122f4f5a5cf09c90fe2";
+SET END_DATE = DATE("2022-01-17"); --exclusively
+
+EXPORT DATA OPTIONS(
+    uri='gs://my_bucket/my_folder/*.csv', -- make sure to change the path to your bucket and folder
+    format='CSV',
+    overwrite=TRUE,
+    header=TRUE,
+    field_delimiter=',') AS
+SELECT FORMAT_DATE("%Y-%m-%d", tt.block_timestamp) AS block_date, tt.from_address AS from_address, tt.to_address AS to_address, tt.value AS value
+FROM `bigquery-public-data.crypto_ethereum.token_transfers` AS tt
+WHERE (tt.from_address IS NOT NULL OR tt.to_address IS NOT NULL) AND SAFE_CAST(tt.value AS FLOAT64) > 0 AND tt.token_address = TARGET_TOKEN_ADDRESS AND DATE(tt.block_timestamp) < END_DATE
+ORDER BY block_date ASC
@@ -1,64 +1,152 @@
 import os
+import sys
 import argparse
+import traceback
+import numpy as np
+import matplotlib
+matplotlib.use('Agg')
+from time import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from metric_heatmap import heatmap_values, load_top_balances, plot_heatmap
+from metric_kernels import METRICS, prefix_metric
+from metric_cache import MAX_AGE, MAX_SIZE, MetricCache
 
 
-formatter = lambda prog: argparse.RawTextHelpFormatter(prog, max_help_position=50)
-parser = argparse.ArgumentParser(
-        description='Calcualte and plot some metric based on the top N addresses',
-        add_help=False,
-        formatter_class=formatter,
-        )
+# loads top balances of a coin/token once and plots heatmaps of all the metrics in a worker process,
+# metrics of weeks being taken from cache_dir if they are cached there
+def run(dir_, name, metrics, Y, latex, ylog, cache_dir=None):
+    start = time()
+    try:
+        _, non_nan_df = load_top_balances(dir_, name, Y[-1])
+        values = non_nan_df.iloc[:Y[-1]].to_numpy()
+        cache = MetricCache(cache_dir) if cache_dir is not None else None
+        for metric in metrics:
+            if cache is not None:
+                mat = cache.compute(metric, values, Y)
+            else:
+                mat = prefix_metric(metric, values, Y)
+            mat = heatmap_values(metric, mat, len(values), Y)
+            plot_heatmap(dir_, name, metric, mat, non_nan_df.columns, Y, latex=latex, ylog=ylog)
+        status = 'done'
+    except Exception:
+        status = 'failed:\n' + traceback.format_exc()
+    return name, status, time() - start
 
-# required arguments
-required_args = parser.add_argument_group('required arguments')
-required_args.add_argument(
-        '--dir',
-        type=str,
-        required=True,
-        help='Path to parent directory with coins/tokens data',
-        )
 
-# optimal arguments
-optional_args = parser.add_argument_group('optional arguments')
-optional_args.add_argument(
-        '-h',
-        '--help',
-        action='help',
-        help='show this help message and exit',
-        )
+def main():
+    formatter = lambda prog: argparse.RawTextHelpFormatter(prog, max_help_position=50)
+    parser = argparse.ArgumentParser(
+            description='Calcualte and plot some metric based on the top N addresses',
+            add_help=False,
+            formatter_class=formatter,
+            )
 
-args = parser.parse_args()
+    # required arguments
+    required_args = parser.add_argument_group('required arguments')
+    required_args.add_argument(
+            '--dir',
+            type=str,
+            required=True,
+            help='Path to parent directory with coins/tokens data',
+            )
 
-DIR = os.path.join(args.dir)
-METRICS = ['entropy', 'gini', 'nakamoto', 'efficiency', 'robin']
-# METRICS = METRICS[-2:]
+    # optimal arguments
+    optional_args = parser.add_argument_group('optional arguments')
+    optional_args.add_argument(
+            '-h',
+            '--help',
+            action='help',
+            help='show this help message and exit',
+            )
+    optional_args.add_argument(
+            '--metrics',
+            type=str,
+            nargs='+',
+            choices=list(METRICS),
+            default=list(METRICS),
+            help='Metrics to plot, defaults to all of them',
+            )
+    optional_args.add_argument(
+            '--min_N',
+            type=int,
+            default=10,
+            help='Minimum number of top addresses to consider, defaults to 10',
+            )
+    optional_args.add_argument(
+            '--max_N',
+            type=int,
+            default=10000,
+            help='Maximum number of top addresses to consider, defaults to 10000',
+            )
+    optional_args.add_argument(
+            '--step_N',
+            type=int,
+            default=10,
+            help='Step for the top addresses, defaults to 10',
+            )
+    optional_args.add_argument(
+            '--workers',
+            type=int,
+            default=os.cpu_count(),
+            help='Number of worker processes, defaults to the number of CPUs',
+            )
+    optional_args.add_argument(
+            '--cache',
+            type=str,
+            default=None,
+            help='Path to directory caching metric values of weeks, so that only new or changed\n'
+                'weeks are computed, defaults to no cache',
+            )
+    optional_args.add_argument(
+            '--cache_max_age',
+            type=int,
+            default=MAX_AGE,
+            help='Remove cached values not used for this number of days, defaults to {}'.format(MAX_AGE),
+            )
+    optional_args.add_argument(
+            '--cache_max_size',
+            type=int,
+            default=MAX_SIZE,
+            help='Maximum size of cache in MB, defaults to {}'.format(MAX_SIZE),
+            )
+    args = parser.parse_args()
 
+    DIR = os.path.join(args.dir)
+    Y = np.arange(args.min_N, args.max_N + args.step_N, args.step_N)
 
-names = [n for n in os.listdir(DIR) if os.path.isdir(os.path.join(DIR, n)) and not 'zcash' in n]
-tokens_dir = [d for d in names if 'tokens' in d][0]
-names.remove(tokens_dir)
-names.sort()
+    names = [n for n in os.listdir(DIR) if os.path.isdir(os.path.join(DIR, n)) and not 'zcash' in n]
+    tokens_dir = [d for d in names if 'tokens' in d][0]
+    names.remove(tokens_dir)
+    names.sort()
+    dirs = [DIR] * len(names)
 
-cmd  = 'python3.9 metric.py --min_N=10 --max_N=10000 --step_N=10 --dir=\'{}\' --latex --ylog '.format(DIR)
+    # for tokens
+    TOKENS_DIR = os.path.join(DIR, tokens_dir)
+    tokens = [n for n in os.listdir(TOKENS_DIR) if os.path.isdir(os.path.join(TOKENS_DIR, n)) and not
+            'scam' in n]
+    tokens.sort()
+    names += tokens
+    dirs += [TOKENS_DIR] * len(tokens)
 
-for name in names:
-    print('\nComputing for {}:'.format(name))
-    for metric in METRICS:
-        print('\t{}'.format(metric.title()))
-        os.system(cmd + '--name=\'{}\' --metric=\'{}\''.format(name, metric))
-exit()
+    # each coin/token is loaded once and all its metrics are computed in one worker process
+    print('Computing {} for {} coins/tokens using {} workers...'.format(', '.join(args.metrics),
+        len(names), args.workers))
+    start = time()
+    failed = False
+    with ProcessPoolExecutor(max_workers=args.workers) as executor:
+        futures = [executor.submit(run, dir_, name, args.metrics, Y, True, True, args.cache) for
+                dir_, name in zip(dirs, names)]
+        for future in as_completed(futures):
+            name, status, elapsed = future.result()
+            failed |= status != 'done'
+            print(' {}: {} in {:.4f} s'.format(name, status, elapsed))
+    if args.cache is not None:
+        print('Removed {} cached values'.format(MetricCache(args.cache).evict(args.cache_max_age,
+            args.cache_max_size)))
+    print('Elapsed time: {:.4f} s'.format(time() - start))
+    if failed:
+        sys.exit(1)
 
 
-# for tokens
-DIR = os.path.join(DIR, tokens_dir)
-
-names = [n for n in os.listdir(DIR) if os.path.isdir(os.path.join(DIR, n)) and not 'scam' in n]
-names.sort()
-
-cmd  = 'python3.9 metric.py --min_N=10 --max_N=10000 --step_N=10 --dir=\'{}\' --latex --ylog '.format(DIR)
-
-for name in names:
-    print('\nComputing for {}:'.format(name))
-    for metric in METRICS:
-        print('\t{}'.format(metric.title()))
-        os.system(cmd + '--name=\'{}\' --metric=\'{}\''.format(name, metric))
+if __name__ == '__main__':
+    main()
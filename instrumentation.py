@@ -0,0 +1,107 @@
+#!/usr/bin/env python3.9
+
+# This module contains opt-in instrumentation of main.py, split_csv.py and calc_top_holders.py: the time
+# spent in each stage of a script (e.g., parsing CSV files, accumulating balances, extracting top
+# balances) is summed up, and a JSON line is appended to a file for every period (date) and at the end,
+# with rows processed, holders with positive balances and peak resident memory. One stage can also be
+# profiled by cProfile, whose statistics are saved next to the JSON lines. Without a file, stages are not
+# timed at all.
+
+import sys
+import json
+import cProfile
+import resource
+import numpy as np
+from time import perf_counter, time
+from contextlib import contextmanager, nullcontext
+
+
+# returns the peak resident memory of this process in megabytes
+def peak_rss():
+    # ru_maxrss is in kilobytes on Linux but in bytes on macOS
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / (1024 ** 2 if sys.platform == 'darwin'
+            else 1024)
+
+
+class Instrumentation:
+    def __init__(self, script, fname=None, profile=None):
+        if profile is not None and fname is None:
+            raise ValueError('Stage \"{}\" can only be profiled along with --stats!'.format(profile))
+        self.script = script
+        self.fname = fname
+        self.enabled = fname is not None
+        self.seconds = {}
+        self.calls = {}
+        self.rows = 0
+        self.periods = 0
+        self._file = open(fname, 'a') if self.enabled else None
+        self._profile = profile
+        self._profiler = cProfile.Profile() if profile is not None else None
+        self._start = perf_counter()
+
+    def emit(self, event, **fields):
+        if self._file is None:
+            return
+        self._file.write(json.dumps(dict({'script': self.script, 'event': event, 'time': time()},
+            **fields)) + '\n')
+        self._file.flush()
+
+    @contextmanager
+    def _stage(self, name):
+        profile = self._profiler is not None and name == self._profile
+        if profile:
+            self._profiler.enable()
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            self.seconds[name] = self.seconds.get(name, 0) + perf_counter() - start
+            self.calls[name] = self.calls.get(name, 0) + 1
+            if profile:
+                self._profiler.disable()
+
+    # times the code of a with-statement as a stage
+    def stage(self, name):
+        return self._stage(name) if self.enabled else nullcontext()
+
+    # times getting items from an iterable as a stage; with files read by prefetch threads (see
+    # transfers.py), this is the time waiting for them, hence --prefetch=0 is needed to profile parsing
+    def iterate(self, name, iterable):
+        return self._iterate(name, iterable) if self.enabled else iterable
+
+    def _iterate(self, name, iterable):
+        iterator = iter(iterable)
+        while True:
+            with self._stage(name):
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+            yield item
+
+    # records a period (e.g., a week) of rows rows, and the number of holders with positive balances
+    def period(self, date, rows, balances=None):
+        if not self.enabled:
+            return
+        rows = int(rows)
+        self.rows += rows
+        self.periods += 1
+        self.emit('period', date=date, rows=rows,
+                holders=int(np.count_nonzero(balances.values > 0)) if balances is not None else None,
+                peak_rss_mb=peak_rss(), seconds=dict(self.seconds))
+
+    # emits the total time of each stage and saves statistics of the profiled stage
+    def close(self):
+        if not self.enabled:
+            return
+        profile = None
+        if self._profiler is not None:
+            profile = '{}.{}.{}.prof'.format(self.fname, self.script, self._profile)
+            self._profiler.dump_stats(profile)
+        self.emit('summary', rows=self.rows, periods=self.periods, peak_rss_mb=peak_rss(),
+                elapsed=perf_counter() - self._start,
+                stages={name: {'seconds': self.seconds[name], 'calls': self.calls[name]} for name in
+                    self.seconds},
+                profile=profile)
+        self._file.close()
+        self._file = None
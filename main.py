@@ -1,22 +1,166 @@
 #!/usr/bin/env python3.9
 
-# This script can be used to calculate weekly top N ERC20 token balances from CSV files 
-# downloaded from GCS.
+# This script can be used to calculate weekly (or daily, monthly, etc.) top N ERC20 token balances from
+# CSV files downloaded from GCS.
 #
 # Author:  Roman Overko
 # Contact: roman.overko@iota.org
 # Date:    July 15, 2022
 
 import os
+import gc
+import pickle
 import argparse
-import datetime
-import pandas as pd
+import numpy as np
 from time import time
-from collections import deque, defaultdict
-from io import StringIO
+from instrumentation import Instrumentation
+from balances import AddressIndex, BalanceHistory, BalanceVector, FixedPointBalanceVector, HolderOrder, \
+        TopHoldersMatrix, TopHoldersStore, load_top_holders, top_balances
+from transfers import CADENCES, WEEKDAYS, first_and_last_days, from_day, is_token_file, \
+        is_transfer_file, load_tokens, period_ends, read_transfers, split_periods
 
+# settings that have to match between the run which saved a checkpoint and the one resuming from it
+CHECKPOINT_SETTINGS = ['top', 'keep_address', 'exact', 'decimals', 'cadence', 'weekday', 'every',
+        'history', 'format']
+# stages timed with --stats, any of which can be profiled with --profile
+STAGES = ['parse', 'split', 'accumulate', 'top', 'concat', 'write']
 
-def main():
+
+def load_checkpoint(fname, args):
+    with open(fname, 'rb') as f:
+        gc.disable()
+        checkpoint = pickle.load(f)
+        gc.enable()
+
+    for setting in CHECKPOINT_SETTINGS:
+        if checkpoint['settings'][setting] != getattr(args, setting):
+            raise ValueError('Checkpoint \"{}\" was saved with --{}={}, but --{}={} is given! Please '
+                    'delete it or use the same settings'.format(fname, setting,
+                        checkpoint['settings'][setting], setting, getattr(args, setting)))
+    return checkpoint
+
+
+def save_checkpoint(fname, checkpoint):
+    # write to a temporary file first so that an interrupted run does not corrupt the old checkpoint
+    with open(fname + '.tmp', 'wb') as f:
+        pickle.dump(checkpoint, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(fname + '.tmp', fname)
+
+
+# balances and top balances of one of the tokens in CSV files exported by extract2csv_tokens.sql
+class TokenState:
+    def __init__(self, fname, decimals, args, num_snapshots):
+        self.fname = fname
+        self.decimals = decimals
+        self.address_index = AddressIndex()
+        self.balances = FixedPointBalanceVector(decimals) if args.exact else BalanceVector()
+        self.order = HolderOrder() if args.keep_address else None
+        self.top_holders = TopHoldersMatrix(args.top, num_snapshots, keep_address=args.keep_address) if \
+                args.format == 'csv' else None
+        self.store = TopHoldersStore(fname, args.top, num_snapshots, keep_address=args.keep_address) if \
+                args.format == 'npy' else None
+
+    # adds raw amounts to balances of address IDs, which are scaled here unless they are accumulated
+    # exactly
+    def add(self, ids, values, exact=False):
+        self.balances.add(ids, values if exact else values / 10 ** self.decimals)
+        if self.order is not None:
+            self.order.touch(ids)
+
+    def snapshot(self, date, top, keep_address=False):
+        top_ids, top_values = self.order.top(self.balances, top) if self.order is not None else \
+                top_balances(self.balances, top)
+        if self.store is not None:
+            self.store.append(date, top_values, top_ids)
+        else:
+            self.top_holders.append(date, top_values,
+                    self.address_index.lookup(top_ids) if keep_address else None)
+
+    def save(self, keep_address=False):
+        if self.store is not None:
+            self.store.close(self.address_index.addresses if keep_address else None)
+        else:
+            self.top_holders.to_frame().to_csv(self.fname)
+
+
+# calculates top balances of each of the tokens (see load_tokens()) at the given snapshots (days) in one
+# pass over CSV files exported by extract2csv_tokens.sql, keeping separate balances of each token; the
+# top balances of a token are saved in DIR/{name of token}/basename
+def process_tokens(args, tokens, csv_paths, snapshots, basename, stats):
+    states = []
+    for name, decimals in zip(tokens['name'], tokens['decimals']):
+        TOKEN_DIR = os.path.join(args.dir, name)
+        if not os.path.isdir(TOKEN_DIR):
+            os.makedirs(TOKEN_DIR)
+        states.append(TokenState(os.path.join(TOKEN_DIR, basename), decimals, args, len(snapshots)))
+    token_ids = {token: i for i, token in enumerate(tokens.index)}
+
+    def snapshot(counter):
+        date = from_day(snapshots[counter]).strftime('%Y-%m-%d')
+        if args.verbose:
+            print(' date {} out of {}'.format(counter + 1, len(snapshots)), end='\r')
+        with stats.stage('top'):
+            for state in states:
+                state.snapshot(date, args.top, args.keep_address)
+        return date
+
+    # splits a chunk into rows of each token (in their order), whose addresses are interned at once
+    def intern(tokens_, addresses):
+        order = np.argsort(tokens_, kind='stable')
+        bounds = np.searchsorted(tokens_[order], np.arange(len(states) + 1))
+        rows = [order[first:last] for first, last in zip(bounds[:-1], bounds[1:])]
+        return rows, [state.address_index.intern(addresses[token_rows]) for state, token_rows in
+                zip(states, rows)]
+
+    # applies rows begin:end of a chunk to the balances of their tokens
+    def accumulate(rows, ids, values, begin, end):
+        for state, token_rows, token_ids in zip(states, rows, ids):
+            first, last = np.searchsorted(token_rows, [begin, end])
+            if last > first:
+                state.add(token_ids[first:last], values[token_rows[first:last]], args.exact)
+
+    print('\nCalculating balances for {} tokens...'.format(len(states)))
+    start = time()
+    snapshot_counter = 0
+    period_rows = 0
+    for days, tokens_, addresses, values in stats.iterate('parse', read_transfers(csv_paths,
+            chunksize=args.chunksize, exact=args.exact, workers=args.prefetch, tokens=token_ids)):
+        with stats.stage('accumulate'):
+            rows, ids = intern(tokens_, addresses)
+        # rows of all tokens are sorted by date, hence a period ends for all of them at once
+        begin = 0
+        for end in stats.iterate('split', split_periods(days, snapshots[snapshot_counter:])):
+            with stats.stage('accumulate'):
+                accumulate(rows, ids, values, begin, end)
+            stats.period(snapshot(snapshot_counter), period_rows + end - begin)
+            snapshot_counter += 1
+            period_rows = 0
+            begin = end
+        with stats.stage('accumulate'):
+            accumulate(rows, ids, values, begin, len(days))
+        period_rows += len(days) - begin
+
+    # the last periods may only have ended with transfers of other tokens
+    while snapshot_counter < len(snapshots):
+        stats.period(snapshot(snapshot_counter), period_rows)
+        snapshot_counter += 1
+        period_rows = 0
+    # rows after the last date are reported as well, so that all rows read are counted
+    stats.period(None, period_rows)
+
+    print(' ' * 50, end='\r')
+    print('Calculating done! Saving data...')
+    with stats.stage('write'):
+        for state in states:
+            state.save(args.keep_address)
+    stats.close()
+    print('Elapsed time: {:.4f} s'.format(time() - start))
+    print('Data saved in {}'.format(', '.join(state.fname for state in states)))
+    if args.stats is not None:
+        print('Stats saved in {}'.format(args.stats))
+
+
+def main(argv=None):
     formatter = lambda prog: argparse.RawTextHelpFormatter(prog, max_help_position=50)
     parser = argparse.ArgumentParser(
             description='Converts and splits CSV files (downloaded from GCS) to weekly data saved in '
@@ -66,7 +210,104 @@ def main():
             default=False,
             help='Keep address along with its values, defaults to False'
             )
-    args = parser.parse_args()
+    optional_args.add_argument(
+            '--format',
+            type=str,
+            choices=['csv', 'npy'],
+            default='csv',
+            help='Format of top balances: a CSV file, or a folder with binary (npy) matrices\n'
+                'written as they are calculated, which can be memory mapped, defaults to csv',
+            )
+    optional_args.add_argument(
+            '--cadence',
+            type=str,
+            choices=CADENCES,
+            default='weekly',
+            help='How often to calculate top balances: daily, weekly (see --weekday), monthly,\n'
+                'or every N days (see --every), defaults to weekly',
+            )
+    optional_args.add_argument(
+            '--weekday',
+            type=str,
+            choices=WEEKDAYS,
+            default='sunday',
+            help='Day of week to calculate top balances on with --cadence=weekly,\n'
+                'defaults to sunday',
+            )
+    optional_args.add_argument(
+            '--every',
+            type=int,
+            default=7,
+            help='Number of days between dates of top balances with --cadence=days,\n'
+                'defaults to 7',
+            )
+    optional_args.add_argument(
+            '--exact',
+            action='store_true',
+            default=False,
+            help='Accumulate raw integer token amounts (exported by extract2csv_exact.sql) exactly\n'
+                'in fixed point instead of floats, defaults to False'
+            )
+    optional_args.add_argument(
+            '--decimals',
+            type=int,
+            default=18,
+            help='Decimals of ERC20 token used to scale raw amounts with --exact or in CSV files\n'
+                'exported by extract2csv_transfers.sql, defaults to 18',
+            )
+    optional_args.add_argument(
+            '--chunksize',
+            type=int,
+            default=1000000,
+            help='Number of CSV rows read at once, which bounds memory usage, defaults to 1000000',
+            )
+    optional_args.add_argument(
+            '--prefetch',
+            type=int,
+            default=1,
+            help='Number of threads reading next CSV files while balances are calculated,\n'
+                'or 0 to read them in the main thread, defaults to 1',
+            )
+    optional_args.add_argument(
+            '--history',
+            action='store_true',
+            default=False,
+            help='Save balances of all addresses which changed in each period, which allows\n'
+                'to query the balance history of any address, defaults to False'
+            )
+    optional_args.add_argument(
+            '--checkpoint',
+            action='store_true',
+            default=False,
+            help='Save balances after calculating and, if they were saved before, only process\n'
+                'CSV files added since then, defaults to False'
+            )
+    optional_args.add_argument(
+            '--stats',
+            type=str,
+            default=None,
+            help='Append timings of stages, rows, holders and peak memory of every date\n'
+                'as JSON lines to this file, defaults to None',
+            )
+    optional_args.add_argument(
+            '--profile',
+            type=str,
+            choices=STAGES,
+            default=None,
+            help='Profile this stage by cProfile (saved next to --stats), defaults to None',
+            )
+    optional_args.add_argument(
+            '--tokens',
+            type=str,
+            default=None,
+            help='CSV file of tokens (with columns token_address, name and decimals) whose top\n'
+                'balances are calculated at once from CSV files of their transfers exported by\n'
+                'extract2csv_tokens.sql, saved in folders DIR/{name of token}, defaults to None',
+            )
+    args = parser.parse_args(argv)
+    if args.tokens is not None and (args.history or args.checkpoint):
+        raise ValueError('Neither --history nor --checkpoint can be used along with --tokens!')
+    stats = Instrumentation('main', args.stats, args.profile)
     
     DIR = os.path.join(args.dir, args.name)
     if not os.path.isdir(DIR):
@@ -85,106 +326,196 @@ def main():
 
     CSV_FILES = list(sorted(CSV_FILES))
     
+    CSV_PATHS = [os.path.join(CSV_DIR, file_) for file_ in CSV_FILES]
+    
     # get the first and last dates
-    df = pd.read_csv(os.path.join(CSV_DIR, CSV_FILES[0]), nrows=1)
-    with open(os.path.join(CSV_DIR, CSV_FILES[-1]), 'r') as f:
-        q = deque(f, 1)
-    df = pd.concat([df, pd.read_csv(StringIO(''.join(q)), names=df.columns)])
-    df['block_date'] = pd.to_datetime(df['block_date'])
-    FIRST_DATE, LAST_DATE = df['block_date']
-    del df
-    assert LAST_DATE > FIRST_DATE
-    LAST_DATE += datetime.timedelta(days=-1)
-
-    # calculate the end date as the last sunday before LAST_DATE
-    if not LAST_DATE.weekday() == 6:
-        END_DATE = LAST_DATE - datetime.timedelta(days=(LAST_DATE.weekday() + 1))
-    else:
-        END_DATE = LAST_DATE
-    assert END_DATE.weekday() == 6 # the end date of balances will be the last Sunday w.r.t. LAST_DATE
-    print('You have data collected until \'{}\' including.'.format(LAST_DATE.strftime('%Y-%m-%d')))
-    print('The last date, for which top balances will be calculated, is\n\tthe last Sunday before '
-            '\'{}\': namely, \'{}\'.'.format(LAST_DATE.strftime('%Y-%m-%d'), 
+    FIRST_DAY, LAST_DAY = first_and_last_days(CSV_PATHS)
+    assert LAST_DAY > FIRST_DAY
+    FIRST_DATE, LAST_DATE = from_day(FIRST_DAY), from_day(LAST_DAY - 1)
+    print('You have data collected since \'{}\' until \'{}\' including.'.format(
+        FIRST_DATE.strftime('%Y-%m-%d'), LAST_DATE.strftime('%Y-%m-%d')))
+    # CSV files exported by extract2csv_transfers.sql have one row per transfer instead of two, and the
+    # ones exported by extract2csv_tokens.sql have transfers of several tokens
+    TRANSFERS = is_transfer_file(CSV_PATHS[0])
+    # transfers of several tokens must not be summed up into the same balances
+    if is_token_file(CSV_PATHS[0]) and args.tokens is None:
+        raise ValueError('CSV files in \"{}\" have transfers of several tokens! Please list the ones to '
+                'process in a file given by --tokens'.format(CSV_DIR))
+    if args.tokens is not None and not is_token_file(CSV_PATHS[0]):
+        raise ValueError('CSV files in \"{}\" have no column token_address! Please use --tokens only '
+                'with files exported by extract2csv_tokens.sql'.format(CSV_DIR))
+    if args.tokens is not None:
+        TOKENS = load_tokens(args.tokens)
+        print('CSV files have transfers of several tokens, {} of which are listed in \"{}\".'.format(
+            len(TOKENS), args.tokens))
+    elif TRANSFERS:
+        print('CSV files have one row per transfer, whose amounts are scaled by 10^{}.'.format(
+            args.decimals))
+
+    # top balances are calculated at the ends of periods of the given cadence between FIRST_DATE and
+    # LAST_DATE, except for the first one, so that the first period is complete
+    SNAPSHOTS = period_ends(FIRST_DAY, LAST_DAY - 1, args.cadence, WEEKDAYS.index(args.weekday),
+            args.every)[1:]
+    NUM_SNAPSHOTS = len(SNAPSHOTS)
+    assert NUM_SNAPSHOTS > 0
+    START_DATE, END_DATE = from_day(SNAPSHOTS[0]), from_day(SNAPSHOTS[-1])
+    CADENCE = {
+            'daily': 'daily',
+            'weekly': 'weekly (on {}s)'.format(args.weekday.title()),
+            'monthly': 'monthly (on the last day of a month)',
+            'days': 'every {} days'.format(args.every),
+            }[args.cadence]
+    print('Top balances will be calculated {}: there are {} dates between\n\t\'{}\' and \'{}\' '
+            'including.'.format(CADENCE, NUM_SNAPSHOTS, START_DATE.strftime('%Y-%m-%d'),
                 END_DATE.strftime('%Y-%m-%d')))
+
+    # the cadence is only added to file names if it is not the default one
+    CADENCE = {
+            'daily': '_daily',
+            'weekly': '' if args.weekday == 'sunday' else '_weekly_' + args.weekday,
+            'monthly': '_monthly',
+            'days': '_every{}days'.format(args.every),
+            }[args.cadence]
+    fname = os.path.join(DIR, 'top{}_token_holders{}_{}'.format(args.top, CADENCE,
+        END_DATE.strftime('%Y-%m-%d')) + '_addresses' * args.keep_address)
+    fname += '.csv' if args.format == 'csv' else ''
+    if args.tokens is not None:
+        process_tokens(args, TOKENS, CSV_PATHS, SNAPSHOTS, os.path.basename(fname), stats)
+        return
+
+    snapshot_counter = 0
+    top_holders = TopHoldersMatrix(args.top, NUM_SNAPSHOTS, keep_address=args.keep_address) if \
+            args.format == 'csv' else None
+    previous = None
+    address_index = AddressIndex()
+    balances = FixedPointBalanceVector(args.decimals) if args.exact else BalanceVector()
+    # tied balances are listed with addresses in the order of the original code
+    order = HolderOrder() if args.keep_address else None
+    history = BalanceHistory() if args.history else None
+    done_files = []
+
+    CHECKPOINT = os.path.join(DIR, 'checkpoint.pkl')
+    if args.checkpoint and os.path.isfile(CHECKPOINT):
+        checkpoint = load_checkpoint(CHECKPOINT, args)
+        done_files = checkpoint['files']
+        if CSV_FILES[:len(done_files)] != done_files:
+            raise ValueError('CSV files in \"{}\" do not extend the ones saved in checkpoint \"{}\"! '
+                    'Please delete the checkpoint'.format(CSV_DIR, CHECKPOINT))
+        snapshot_counter = checkpoint['snapshot_counter']
+        address_index, balances = checkpoint['address_index'], checkpoint['balances']
+        top_holders, history = checkpoint['top_holders'], checkpoint['history']
+        order = checkpoint.get('order', order)
+        if order is not None and 'order' not in checkpoint:
+            # checkpoints saved before the order was kept list holders in order of their IDs
+            order.touch(np.flatnonzero(balances.values != 0))
+        if top_holders is not None:
+            top_holders.resize(NUM_SNAPSHOTS)
+        else:
+            # rows saved by the previous run are copied into the new files
+            dates, values, ids, _ = load_top_holders(checkpoint['store'])
+            previous = dates, np.array(values), (np.array(ids) if ids is not None else None)
+        print('\nResuming from checkpoint: {} CSV files and {} dates are already processed.'.format(
+            len(done_files), snapshot_counter))
     
-    # calculate the start date as the first sunday after FIRST_DATE
-    if not FIRST_DATE.weekday() == 6:
-        START_DATE = FIRST_DATE + datetime.timedelta(days=(6 - FIRST_DATE.weekday()))
-    else:
-        START_DATE = FIRST_DATE
-    START_DATE += datetime.timedelta(weeks=1)
-    assert START_DATE.weekday() == END_DATE.weekday()
-    print('\nYou have data collected since \'{}\' including.'.format(FIRST_DATE.strftime('%Y-%m-%d')))
-    print('The first date, for which top balances will be calculated, is\n\tthe first Sunday after '
-            'a week after \'{}\': namely, \'{}\'.'.format(FIRST_DATE.strftime('%Y-%m-%d'), 
-                START_DATE.strftime('%Y-%m-%d')))
-    
-    # calculate number of weeks
-    NUM_WEEKS = (END_DATE - START_DATE).days
-    assert NUM_WEEKS % 7 == 0
-    NUM_WEEKS = NUM_WEEKS // 7 + 1
-    print('\nThere are {} weeks between \'{}\' and \'{}\'.'.format(NUM_WEEKS,
-        START_DATE.strftime('%Y-%m-%d'), END_DATE.strftime('%Y-%m-%d')))
-    DELTA = datetime.timedelta(weeks=1)
-
-    date = START_DATE
-    week_counter = 1
-    till_date_df = pd.DataFrame()
-    main_df = pd.DataFrame()
-    address_balance_dict = defaultdict(float)
+    store = TopHoldersStore(fname, args.top, NUM_SNAPSHOTS, keep_address=args.keep_address,
+            previous=previous) if args.format == 'npy' else None
     
     print('\nCalculating balances for \"{}\"...'.format(args.name))
     start = time()
-    for i, file_ in enumerate(CSV_FILES):
-        df = pd.read_csv(os.path.join(CSV_DIR, file_), dtype={'value': float}, parse_dates=['block_date'])
-        
-        till_date_df = pd.concat([till_date_df, df[df['block_date'] <= date][['address', 'value']]])
-        remain_df = df[df['block_date'] > date]
-    
-        while not remain_df.empty:
-            # print('Save at {}'.format(date.strftime('%Y-%m-%d')))
+    period_rows = 0
+    for days, addresses, values in stats.iterate('parse', read_transfers(CSV_PATHS[len(done_files):],
+            chunksize=args.chunksize, exact=args.exact, workers=args.prefetch, transfers=TRANSFERS,
+            decimals=args.decimals)):
+        # addresses of a chunk are interned at once, each call inserting new ones into the sorted index
+        with stats.stage('accumulate'):
+            chunk_ids = address_index.intern(addresses)
+        # rows are sorted by date, hence all periods completed within a chunk are found at once, a period
+        # being saved as soon as a row of the next one is met
+        begin = 0
+        for end in stats.iterate('split', split_periods(days, SNAPSHOTS[snapshot_counter:])):
+            with stats.stage('accumulate'):
+                ids = chunk_ids[begin:end]
+                balances.add(ids, values[begin:end])
+                if order is not None:
+                    order.touch(ids)
+                if history is not None:
+                    history.touch(ids)
+
             if args.verbose:
-                print(' week {} out of {}'.format(week_counter, NUM_WEEKS), end='\r')
-
-            z1 = zip(*till_date_df.to_dict('list').values())
-            for address, value in z1:
-                address_balance_dict[address] += value
-
-            if not args.keep_address:
-                sorted_d = [b for b in address_balance_dict.values() if b > 0]
-                sorted_d.sort(reverse=True)
-                sorted_d_len = len(sorted_d)
-                cut = args.top if sorted_d_len >= args.top else sorted_d_len
-                df = pd.DataFrame({date.strftime('%Y-%m-%d'): sorted_d[:cut]})
-            else:
-                address_balance_dict = defaultdict(float, {k: v for k, v in sorted(
-                    address_balance_dict.items(), reverse=True, key=lambda item: item[1]) if v})
-                sorted_d_len = len(address_balance_dict)
-                cut = args.top if sorted_d_len >= args.top else sorted_d_len
-                df = pd.DataFrame({date.strftime('%Y-%m-%d'): list(address_balance_dict.keys())[:cut]})
-                df = pd.concat([df, pd.DataFrame({'': list(address_balance_dict.values())[:cut]})], axis=1)
-
-            main_df = pd.concat([main_df, df], axis=1)
-
-            week_counter += 1
-            date += DELTA
-    
-            df = remain_df
-            till_date_df = df[df['block_date'] <= date][['address', 'value']]
-            remain_df = df[df['block_date'] > date]
+                print(' date {} out of {}'.format(snapshot_counter + 1, NUM_SNAPSHOTS), end='\r')
+
+            with stats.stage('top'):
+                top_ids, top_values = order.top(balances, args.top) if order is not None else \
+                        top_balances(balances, args.top)
+            date = from_day(SNAPSHOTS[snapshot_counter]).strftime('%Y-%m-%d')
+            with stats.stage('concat'):
+                if store is not None:
+                    store.append(date, top_values, top_ids)
+                else:
+                    top_holders.append(date, top_values,
+                            address_index.lookup(top_ids) if args.keep_address else None)
+            with stats.stage('accumulate'):
+                if history is not None:
+                    history.close_period(snapshot_counter, balances)
+            stats.period(date, period_rows + end - begin, balances)
+
+            snapshot_counter += 1
+            period_rows = 0
+            begin = end
 
-    assert week_counter - 1 == NUM_WEEKS
-    assert main_df.shape[1] == NUM_WEEKS if not args.keep_address else NUM_WEEKS // 2
+        with stats.stage('accumulate'):
+            ids = chunk_ids[begin:]
+            balances.add(ids, values[begin:])
+            if order is not None:
+                order.touch(ids)
+            if history is not None:
+                history.touch(ids)
+        period_rows += len(days) - begin
+    # rows after the last date are reported as well, so that all rows read are counted
+    stats.period(None, period_rows, balances)
+
+    assert snapshot_counter == NUM_SNAPSHOTS
+    assert len(store if store is not None else top_holders) == NUM_SNAPSHOTS
     
     print(' ' * 50, end='\r')
     print('Calculating done! Saving data...')
-    fname = os.path.join(DIR, 'top{}_token_holders_{}'.format(args.top, END_DATE.strftime('%Y-%m-%d')) +\
-            '_addresses' * args.keep_address + '.csv')
-    main_df.to_csv(fname)
-    if args.verbose:
+    if store is not None:
+        with stats.stage('write'):
+            store.close(address_index.addresses if args.keep_address else None)
+        dates = store.dates
+    else:
+        with stats.stage('concat'):
+            main_df = top_holders.to_frame()
+        with stats.stage('write'):
+            main_df.to_csv(fname)
+        dates = top_holders.dates
+    with stats.stage('write'):
+        if args.history:
+            HISTORY_DIR = os.path.join(DIR, 'history' + CADENCE)
+            history.save(HISTORY_DIR, address_index.addresses, dates)
+        if args.checkpoint:
+            save_checkpoint(CHECKPOINT, {
+                'settings': {setting: getattr(args, setting) for setting in CHECKPOINT_SETTINGS},
+                'files': CSV_FILES,
+                'snapshot_counter': snapshot_counter,
+                'address_index': address_index,
+                'balances': balances,
+                'order': order,
+                'top_holders': top_holders,
+                'store': fname if store is not None else None,
+                'history': history,
+                })
+    stats.close()
+    if args.verbose and store is None:
         print(main_df.iloc[:20, :])
     print('Elapsed time: {:.4f} s'.format(time() - start))
     print('Data saved in {}'.format(fname))
+    if args.history:
+        print('Balance history saved in {}'.format(HISTORY_DIR))
+    if args.checkpoint:
+        print('Checkpoint saved in {}'.format(CHECKPOINT))
+    if args.stats is not None:
+        print('Stats saved in {}'.format(args.stats))
 
 
 if __name__ == '__main__':
@@ -2,109 +2,17 @@
 
 import os
 import argparse
-import datetime
+import traceback
 import pandas as pd
 import numpy as np
-from pprint import pprint
-from collections import defaultdict
+import matplotlib
+matplotlib.use('Agg')
 import matplotlib.pyplot as plt
-import matplotlib.colors as mcol
-import matplotlib.dates as mdates
-import matplotlib.cm as cm
 from time import time
-
-
-def entropy(x):
-    return -np.dot(x, np.log(x))
-
-
-def gini(x):
-    # s = 0
-    # for i in range(len(x)):
-        # s += np.abs(x[i] - x).sum()
-    # return s / (2 * len(x))
-    return np.abs(np.tril(np.subtract.outer(x, x))).sum() / len(x)
-
-
-def nakamoto(x):
-    half = 0.5 * x.sum()
-    s = 0
-    for i in range(1, len(x) + 1):
-        s += x[i-1]
-        if s > half:
-            return i
-
-
-def efficiency(x):
-    return entropy(x) / np.log(len(x))
-
-
-def robin(x):
-    return 0.5 * np.abs(x - 1 / len(x)).sum()
-
-
-formatter = lambda prog: argparse.RawTextHelpFormatter(prog, max_help_position=50)
-parser = argparse.ArgumentParser(
-        description='Calcualte and plot some metric based on the top N addresses',
-        add_help=False,
-        formatter_class=formatter,
-        )
-
-# required arguments
-required_args = parser.add_argument_group('required arguments')
-required_args.add_argument(
-        '--dir',
-        type=str,
-        required=True,
-        help='Path to parent directory with coins/tokens data',
-        )
-required_args.add_argument(
-        '--metric',
-        type=str,
-        choices=['entropy', 'gini', 'nakamoto', 'efficiency', 'robin'],
-        required=True,
-        help='Metric to plot. Available metrics: entropy, '
-        )
-required_args.add_argument(
-        '--N',
-        type=int,
-        required=True,
-        help='Top N token holders to consider',
-        )
-
-# optimal arguments
-optional_args = parser.add_argument_group('optional arguments')
-optional_args.add_argument(
-        '-h',
-        '--help',
-        action='help',
-        help='show this help message and exit',
-        )
-optional_args.add_argument(
-        '--verbose',
-        action='store_true',
-        default=False,
-        help='Print detailed output to console, defaults to False'
-        )
-optional_args.add_argument(
-        '--top',
-        type=int,
-        default=10000,
-        help='How many top holders to consider, defaults to 10000',
-        )
-optional_args.add_argument(
-        '--latex',
-        action='store_true',
-        default=False,
-        help='Use LaTeX font on figures, defaults to False'
-        )
-optional_args.add_argument(
-        '--ylog',
-        action='store_true',
-        default=False,
-        help='Use log scale on y-axis, defaults to False'
-        )
-args = parser.parse_args()
+from concurrent.futures import ProcessPoolExecutor
+from metric_kernels import METRICS, prefix_metric
+from metric_cache import MAX_AGE, MAX_SIZE, MetricCache
+from metric_heatmap import metric_label, read_top_balances
 
 LABELS = {
         'ChainLink Token': 'LINK',
@@ -118,78 +26,204 @@ LABELS = {
         'Wrapped Bitcoin (WBTC)': 'WBTC'
         }
 
-if args.latex:
-    plt.rcParams['font.size'] = 20
-    plt.rcParams['font.family'] = 'serif'
-    plt.rcParams['font.serif'] = ['Times New Roman'] + plt.rcParams['font.serif']
-    plt.rc('text', usetex=True)
-
-fig, ax = plt.subplots(figsize=(8.636, 5.2)) # this width is twice larger for double-column IEEE articles
+# series of all tokens, metrics and N are saved in this file in args.dir, one value per row
+SERIES_CSV = 'tokens_metrics.csv'
 
-token_csvs = [f for f in os.listdir(args.dir) if 'csv' in f]
-for token_csv in token_csvs:
-    # if token_csv in ['Theta Token.csv', 'stETH.csv']:
-        # continue
 
-    df = pd.read_csv(os.path.join(args.dir, token_csv), header=0, index_col=0)
-    df.drop(df.index[0], inplace=True)
+# loads top balances of a token once and computes all the metrics for all N in a worker process; returns
+# the name of the token, the number of dropped weeks and a data frame of the series
+def compute(dir_, token_csv, metrics, Ns, top, cache_dir=None):
+    df = read_top_balances(os.path.join(dir_, token_csv), max(top, max(Ns)))
 
     FIRST_COL = None
     for i, col in enumerate(df):
-        if not df[col][:args.top].isnull().sum():
+        if not df[col][:top].isnull().sum():
             FIRST_COL = col
             break
     non_nan_df = df.loc[:, FIRST_COL:].copy()
-
     name = token_csv.split('.')[0]
-    print('First {} weeks dropped for \"{}\"'.format(df.shape[-1] - non_nan_df.shape[-1], name))
-
-    X = pd.to_datetime(non_nan_df.columns)
-    Y = []
-
-    for i, col in enumerate(non_nan_df):
-        # some token addresses have zero or nagative balance, this may cause warning when 
-        # computing entropy so we will replace 'bad' values with machine epsilon
-        non_nan_df.loc[np.isclose(non_nan_df[col], 0), col] = np.finfo(float).eps
-
-        top_N = non_nan_df[col][:args.N].to_numpy()
-        top_N = top_N / top_N.sum()
-        assert np.isclose(top_N.sum(), 1)
-        
-        if args.metric == 'entropy':
-            Y.append(entropy(top_N))
-        elif args.metric == 'gini':
-            Y.append(gini(top_N))
-        elif args.metric == 'nakamoto':
-            Y.append(nakamoto(top_N))
-        elif args.metric == 'efficiency':
-            Y.append(efficiency(top_N))
-        elif args.metric == 'robin':
-            Y.append(robin(top_N))
+
+    # some token addresses have zero or nagative balance, this may cause warning when
+    # computing entropy so we will replace 'bad' values with machine epsilon
+    top_N = non_nan_df.iloc[:max(Ns)].to_numpy(copy=True)
+    top_N[np.isclose(top_N, 0)] = np.finfo(float).eps
+
+    # each metric is computed for all weeks and all N at once, or only for new weeks if they are cached
+    cache = MetricCache(cache_dir) if cache_dir is not None else None
+    series = []
+    for metric in metrics:
+        if cache is not None:
+            mat = cache.compute(metric, top_N, Ns)
         else:
-            pass
-    
-    plt.plot(X, Y, linewidth=3, label=LABELS[name])
-
-ax.set_title('Sample size {}N = {}{}'.format('$' if args.latex else '', args.N,
-    '$' if args.latex else ''))
-
-ax.xaxis_date()
-ax.set_xlabel('Year')
-
-if args.ylog:
-    plt.yscale('log')
-y_label = '{}'.format(args.metric.title())
-if args.metric in ['gini', 'nakamoto']:
-    y_label += ' coefficient'
-elif args.metric == 'robin':
-    y_label += ' Hood index'
-ax.set_ylabel(y_label)
-
-plt.legend(labelspacing=0.1, fontsize='small')
-
-plt.savefig(
-        os.path.join(args.dir, 'tokens_{}_N={}.pdf'.format(args.metric, args.N)),
-        format='PDF',
-        bbox_inches='tight',
-        )
+            mat = prefix_metric(metric, top_N, Ns)
+        for N, values in zip(Ns, mat):
+            series.append(pd.DataFrame({'token': name, 'metric': metric, 'N': N,
+                'date': non_nan_df.columns, 'value': values}))
+    return name, df.shape[-1] - non_nan_df.shape[-1], pd.concat(series, ignore_index=True)
+
+
+# plots the series of all tokens for one metric and N
+def plot_metric(dir_, series, metric, N, latex=False, ylog=False):
+    fig, ax = plt.subplots(figsize=(8.636, 5.2)) # this width is twice larger for double-column IEEE articles
+
+    for name, token_series in series.groupby('token', sort=False):
+        plt.plot(pd.to_datetime(token_series['date']), token_series['value'], linewidth=3,
+                label=LABELS.get(name, name))
+
+    ax.set_title('Sample size {}N = {}{}'.format('$' if latex else '', N, '$' if latex else ''))
+
+    ax.xaxis_date()
+    ax.set_xlabel('Year')
+
+    if ylog:
+        plt.yscale('log')
+    ax.set_ylabel(metric_label(metric))
+
+    plt.legend(labelspacing=0.1, fontsize='small')
+
+    plt.savefig(
+            os.path.join(dir_, 'tokens_{}_N={}.pdf'.format(metric, N)),
+            format='PDF',
+            bbox_inches='tight',
+            )
+    plt.close(fig)
+
+
+def main():
+    formatter = lambda prog: argparse.RawTextHelpFormatter(prog, max_help_position=50)
+    parser = argparse.ArgumentParser(
+            description='Calcualte and plot some metrics based on the top N addresses for all tokens',
+            add_help=False,
+            formatter_class=formatter,
+            )
+
+    # required arguments
+    required_args = parser.add_argument_group('required arguments')
+    required_args.add_argument(
+            '--dir',
+            type=str,
+            required=True,
+            help='Path to parent directory with coins/tokens data',
+            )
+    required_args.add_argument(
+            '--metric',
+            type=str,
+            nargs='+',
+            choices=list(METRICS),
+            required=True,
+            help='Metrics to plot. Available metrics: {}'.format(', '.join(METRICS)),
+            )
+    required_args.add_argument(
+            '--N',
+            type=int,
+            nargs='+',
+            required=True,
+            help='Top N token holders to consider (one figure per metric and N)',
+            )
+
+    # optimal arguments
+    optional_args = parser.add_argument_group('optional arguments')
+    optional_args.add_argument(
+            '-h',
+            '--help',
+            action='help',
+            help='show this help message and exit',
+            )
+    optional_args.add_argument(
+            '--verbose',
+            action='store_true',
+            default=False,
+            help='Print detailed output to console, defaults to False'
+            )
+    optional_args.add_argument(
+            '--top',
+            type=int,
+            default=10000,
+            help='How many top holders to consider, defaults to 10000',
+            )
+    optional_args.add_argument(
+            '--latex',
+            action='store_true',
+            default=False,
+            help='Use LaTeX font on figures, defaults to False'
+            )
+    optional_args.add_argument(
+            '--ylog',
+            action='store_true',
+            default=False,
+            help='Use log scale on y-axis, defaults to False'
+            )
+    optional_args.add_argument(
+            '--workers',
+            type=int,
+            default=os.cpu_count(),
+            help='Number of worker processes, defaults to the number of CPUs',
+            )
+    optional_args.add_argument(
+            '--cache',
+            type=str,
+            default=None,
+            help='Path to directory caching metric values of weeks, so that only new or changed\n'
+                'weeks are computed, defaults to no cache',
+            )
+    optional_args.add_argument(
+            '--cache_max_age',
+            type=int,
+            default=MAX_AGE,
+            help='Remove cached values not used for this number of days, defaults to {}'.format(MAX_AGE),
+            )
+    optional_args.add_argument(
+            '--cache_max_size',
+            type=int,
+            default=MAX_SIZE,
+            help='Maximum size of cache in MB, defaults to {}'.format(MAX_SIZE),
+            )
+    args = parser.parse_args()
+
+    Ns = sorted(set(args.N))
+    # top balances of tokens are CSV files or folders saved by main.py with --format=npy
+    token_csvs = [f for f in os.listdir(args.dir) if ('csv' in f and f != SERIES_CSV) or
+            os.path.isfile(os.path.join(args.dir, f, 'values.npy'))]
+    if not token_csvs:
+        raise FileNotFoundError('Directory \"{}\" contains no CSV files of top token holders!'.format(
+            args.dir))
+
+    # each token file is read once, by one of the worker processes
+    start = time()
+    results = []
+    with ProcessPoolExecutor(max_workers=args.workers) as executor:
+        futures = [executor.submit(compute, args.dir, token_csv, args.metric, Ns, args.top, args.cache)
+                for token_csv in token_csvs]
+        for token_csv, future in zip(token_csvs, futures):
+            try:
+                results.append(future.result())
+            except Exception:
+                print('Failed to compute metrics for \"{}\":'.format(token_csv))
+                traceback.print_exc()
+    if not results:
+        raise ValueError('Metrics could not be computed for any token in \"{}\"!'.format(args.dir))
+    for name, dropped, _ in results:
+        print('First {} weeks dropped for \"{}\"'.format(dropped, name))
+    series = pd.concat([s for _, _, s in results], ignore_index=True)
+    if args.verbose:
+        print('Metrics computed in {:.4f} s'.format(time() - start))
+
+    if args.latex:
+        plt.rcParams['font.size'] = 20
+        plt.rcParams['font.family'] = 'serif'
+        plt.rcParams['font.serif'] = ['Times New Roman'] + plt.rcParams['font.serif']
+        plt.rc('text', usetex=True)
+
+    for (metric, N), metric_series in series.groupby(['metric', 'N'], sort=False):
+        plot_metric(args.dir, metric_series, metric, N, latex=args.latex, ylog=args.ylog)
+    series.to_csv(os.path.join(args.dir, SERIES_CSV), index=False)
+
+    if args.cache is not None:
+        MetricCache(args.cache).evict(args.cache_max_age, args.cache_max_size)
+    if args.verbose:
+        print('Elapsed time: {:.4f} s'.format(time() - start))
+    print('Series saved in {}'.format(os.path.join(args.dir, SERIES_CSV)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3.9
+
+# This module contains a cache of metric values computed by metric_kernels.py, so that metrics are only
+# computed for weeks which are new or changed since the previous run. Values of a metric for a grid of
+# sample sizes N are saved per week in {dir}/{metric}_{grid}/{column}.npy, where grid and column are
+# hashes of N and of the top balances of the week, respectively. Weeks with the same balances (e.g., in
+# top-holders files of different dates of the same token) hence share cached values.
+
+import os
+import hashlib
+import numpy as np
+from time import time
+from metric_kernels import parallel_prefix_metric
+
+# has to be changed whenever the kernels change, so that values cached by the old ones are not used
+VERSION = 1
+MAX_AGE = 30        # days
+MAX_SIZE = 1024     # megabytes
+
+
+def fingerprint(values):
+    return hashlib.sha1(np.ascontiguousarray(values, dtype=float).tobytes()).hexdigest()
+
+
+class MetricCache:
+    def __init__(self, dir_):
+        self.dir = dir_
+        self.hits = 0
+        self.misses = 0
+
+    def _grid_dir(self, metric, N):
+        grid = hashlib.sha1(np.asarray(N, dtype=np.int64).tobytes() + str(VERSION).encode()).hexdigest()
+        return os.path.join(self.dir, '{}_{}'.format(metric, grid[:16]))
+
+    # returns the metric of the top n holders for every n in N (see metric_kernels.py) for weeks in
+    # columns of x, only computing the ones which are not cached (by worker processes if more than one)
+    def compute(self, metric, x, N, workers=1):
+        x = np.asarray(x, dtype=float)[:np.max(N)]
+        x = x.reshape(len(x), -1)
+        grid_dir = self._grid_dir(metric, N)
+        os.makedirs(grid_dir, exist_ok=True)
+
+        fnames = [os.path.join(grid_dir, fingerprint(x[:, i]) + '.npy') for i in range(x.shape[1])]
+        columns = [None] * len(fnames)
+        for i, fname in enumerate(fnames):
+            try:
+                columns[i] = np.load(fname)
+                # the modification time is the last use, which eviction relies on
+                os.utime(fname)
+            except (OSError, ValueError):
+                pass
+        missing = [i for i, column in enumerate(columns) if column is None]
+        self.hits += len(fnames) - len(missing)
+        self.misses += len(missing)
+
+        if missing:
+            values = parallel_prefix_metric(metric, x[:, missing], N, workers)
+            for j, i in enumerate(missing):
+                columns[i] = values[:, j]
+                # write to a temporary file first, so that concurrent runs never read incomplete files
+                tmp = '{}.{}.tmp'.format(fnames[i], os.getpid())
+                with open(tmp, 'wb') as f:
+                    np.save(f, columns[i])
+                os.replace(tmp, fnames[i])
+        return np.stack(columns, axis=1)
+
+    # removes values which were not used for more than max_age days, and then the least recently used
+    # ones until the cache takes at most max_size megabytes; returns the number of removed files
+    def evict(self, max_age=MAX_AGE, max_size=MAX_SIZE):
+        if not os.path.isdir(self.dir):
+            return 0
+        files = []
+        for root, _, fnames in os.walk(self.dir):
+            for fname in fnames:
+                path = os.path.join(root, fname)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                files.append((stat.st_mtime, stat.st_size, path))
+        files.sort()
+
+        removed = 0
+        size = sum(f[1] for f in files)
+        oldest = time() - max_age * 24 * 60 * 60
+        for mtime, fsize, path in files:
+            if mtime >= oldest and size <= max_size * 1024 * 1024:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            size -= fsize
+            removed += 1
+        return removed
@@ -0,0 +1,142 @@
+#!/usr/bin/env python3.9
+
+# This module contains vectorized kernels of the metrics used by metric.py and metric_heatmap.py, which
+# compute a metric of the top n holders for many values of n at once from cumulative sums of the
+# balances of top holders (sorted in descending order).
+#
+# All kernels take balances x of shape (M,) or (M, W), i.e., the top M balances of one or W weeks in
+# columns, and an array N of sample sizes n, and return an array of shape (len(N),) or (len(N), W);
+# sample sizes n > M are taken as M, i.e., all the balances are used as they were by slicing x[:n].
+
+import numpy as np
+from multiprocessing import shared_memory
+from concurrent.futures import ProcessPoolExecutor
+
+
+# reshapes balances to (M, W) and sample sizes (at most M) to (len(N), 1), so that kernels handle all
+# weeks at once
+def _columns(x, N):
+    x = np.asarray(x, dtype=float)
+    N = np.minimum(np.asarray(N), len(x))
+    return x.reshape(len(x), -1), N.reshape(-1, 1), (len(N),) + x.shape[1:]
+
+
+def _inverse(order):
+    inverse = np.empty_like(order)
+    np.put_along_axis(inverse, order, np.arange(len(order)).reshape(-1, 1), axis=0)
+    return inverse
+
+
+# column-wise np.searchsorted: a has columns sorted in ascending order, v is a matrix of values to
+# search for in the corresponding columns; both are merged by a stable sort, hence the number of
+# entries of a before a value is its position in the merged column minus its rank among the values
+def _searchsorted(a, v, side='left'):
+    merged = np.concatenate([v, a] if side == 'left' else [a, v])
+    positions = _inverse(np.argsort(merged, axis=0, kind='stable'))
+    positions = positions[:len(v)] if side == 'left' else positions[len(a):]
+    return positions - _inverse(np.argsort(v, axis=0, kind='stable'))
+
+
+# Gini coefficient, sum_{i,j} |x_i - x_j| / (2 n sum_i x_i), of the top n holders for every n in N:
+# since x is sorted in descending order, x_k (k = 1..n) is the larger one in n - k pairs and the smaller
+# one in k - 1 pairs, hence sum_{i<j} |x_i - x_j| = (n + 1) sum_k x_k - 2 sum_k k x_k
+def prefix_gini(x, N):
+    x, N, shape = _columns(x, N)
+    cumsum = np.cumsum(x, axis=0)[N[:, 0] - 1]
+    weighted_cumsum = np.cumsum(np.arange(1, len(x) + 1).reshape(-1, 1) * x, axis=0)[N[:, 0] - 1]
+    return (((N + 1) * cumsum - 2 * weighted_cumsum) / (N * cumsum)).reshape(shape)
+
+
+# Shannon entropy of shares p_k = x_k / S of the top n holders, where S = sum_k x_k, which is
+# -sum_k p_k log p_k = log S - sum_k x_k log x_k / S
+def prefix_entropy(x, N):
+    x, N, shape = _columns(x, N)
+    cumsum = np.cumsum(x, axis=0)[N[:, 0] - 1]
+    xlogx_cumsum = np.cumsum(x * np.log(x), axis=0)[N[:, 0] - 1]
+    return (np.log(cumsum) - xlogx_cumsum / cumsum).reshape(shape)
+
+
+def prefix_efficiency(x, N):
+    _, n, shape = _columns(x, N)
+    return prefix_entropy(x, N) / np.log(n).reshape((len(N),) + (1,) * (len(shape) - 1))
+
+
+# Nakamoto coefficient, the least number of top holders which hold more than half of the balance of the
+# top n holders, i.e., one plus the number of cumulative sums which do not exceed a half of the n-th one
+def prefix_nakamoto(x, N):
+    x, N, shape = _columns(x, N)
+    cumsum = np.cumsum(x, axis=0)
+    return (_searchsorted(cumsum, 0.5 * cumsum[N[:, 0] - 1], side='right') + 1).reshape(shape)
+
+
+# Robin Hood index, sum_k |p_k - 1/n| / 2, of the top n holders: only the first m holders have balances
+# above the mean S/n, hence it equals C_m / S - m / n, where C_m is the sum of their balances
+def prefix_robin(x, N):
+    x, N, shape = _columns(x, N)
+    cumsum = np.cumsum(x, axis=0)
+    m = _searchsorted(-x, -cumsum[N[:, 0] - 1] / N, side='left')
+    C_m = np.where(m > 0, np.take_along_axis(cumsum, np.maximum(m - 1, 0), axis=0), 0)
+    return (C_m / cumsum[N[:, 0] - 1] - m / N).reshape(shape)
+
+
+METRICS = {
+        'entropy': prefix_entropy,
+        'gini': prefix_gini,
+        'nakamoto': prefix_nakamoto,
+        'efficiency': prefix_efficiency,
+        'robin': prefix_robin,
+        }
+
+
+# returns the given metric of the top n holders for every n in N
+def prefix_metric(metric, x, N):
+    if metric not in METRICS:
+        raise ValueError('Unknown metric \"{}\"! Available metrics: {}'.format(metric,
+            ', '.join(METRICS)))
+    return METRICS[metric](x, N)
+
+
+# computes the metric for weeks begin:end of a matrix of balances in shared memory, writing the values
+# into another one, so that columns of weeks are neither pickled nor copied to worker processes
+def _prefix_metric_block(metric, x_name, x_shape, out_name, out_shape, out_dtype, N, begin, end):
+    x_shm = shared_memory.SharedMemory(name=x_name)
+    out_shm = shared_memory.SharedMemory(name=out_name)
+    try:
+        x = np.ndarray(x_shape, dtype=float, buffer=x_shm.buf, order='F')
+        out = np.ndarray(out_shape, dtype=out_dtype, buffer=out_shm.buf, order='F')
+        out[:, begin:end] = prefix_metric(metric, x[:, begin:end], N)
+    finally:
+        del x, out
+        x_shm.close()
+        out_shm.close()
+
+
+# parallel counterpart of prefix_metric for balances of weeks in columns of x: the matrix is copied once
+# into shared memory (one contiguous column per week), and each of the worker processes computes the
+# metric for a contiguous block of weeks
+def parallel_prefix_metric(metric, x, N, workers=1):
+    x = np.asarray(x, dtype=float)
+    if workers <= 1 or x.ndim < 2 or x.shape[1] < 2:
+        return prefix_metric(metric, x, N)
+    x = x[:np.max(N)]
+    workers = min(workers, x.shape[1])
+    out_shape = (len(N), x.shape[1])
+    out_dtype = prefix_metric(metric, x[:, :1], N).dtype
+
+    x_shm = shared_memory.SharedMemory(create=True, size=max(x.nbytes, 1))
+    out_size = int(np.prod(out_shape)) * out_dtype.itemsize
+    out_shm = shared_memory.SharedMemory(create=True, size=max(out_size, 1))
+    try:
+        np.ndarray(x.shape, dtype=float, buffer=x_shm.buf, order='F')[:] = x
+        bounds = np.linspace(0, x.shape[1], workers + 1).astype(int)
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(_prefix_metric_block, metric, x_shm.name, x.shape, out_shm.name,
+                out_shape, out_dtype, N, begin, end) for begin, end in zip(bounds[:-1], bounds[1:])]
+            for future in futures:
+                future.result()
+        return np.ndarray(out_shape, dtype=out_dtype, buffer=out_shm.buf, order='F').copy()
+    finally:
+        x_shm.close()
+        x_shm.unlink()
+        out_shm.close()
+        out_shm.unlink()
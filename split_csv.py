@@ -12,6 +12,20 @@ import argparse
 import datetime
 import pandas as pd
 from time import time
+from transfers import first_and_last_days, from_day, parse_days, period_ends, prefetch, save_addresses, \
+        save_week, split_periods
+from balances import AddressIndex
+from instrumentation import Instrumentation
+
+# stages timed with --stats, any of which can be profiled with --profile
+STAGES = ['parse', 'split', 'concat', 'write']
+
+
+def read_shard(fname):
+    df = pd.read_csv(fname, dtype={'block_date': str, 'value': float})
+    # rows without an address are skipped as by read_chunks()
+    df = df[df['address'].notna()]
+    yield parse_days(df['block_date']), df[['address', 'value']]
 
 
 def main():
@@ -64,7 +78,37 @@ def main():
             default=False,
             help='Print detailed output to console, defaults to False'
             )
+    optional_args.add_argument(
+            '--format',
+            type=str,
+            choices=['pkl', 'npy'],
+            default='pkl',
+            help='Format of weekly data: pickled data frames or columnar NumPy arrays with\n'
+                'address IDs (to be memory mapped by calc_top_holders.py), defaults to pkl',
+            )
+    optional_args.add_argument(
+            '--prefetch',
+            type=int,
+            default=1,
+            help='Number of threads reading next CSV files while weekly data is saved,\n'
+                'or 0 to read them in the main thread, defaults to 1',
+            )
+    optional_args.add_argument(
+            '--stats',
+            type=str,
+            default=None,
+            help='Append timings of stages, rows and peak memory of every week as JSON lines\n'
+                'to this file, defaults to None',
+            )
+    optional_args.add_argument(
+            '--profile',
+            type=str,
+            choices=STAGES,
+            default=None,
+            help='Profile this stage by cProfile (saved next to --stats), defaults to None',
+            )
     args = parser.parse_args()
+    stats = Instrumentation('split_csv', args.stats, args.profile)
     
     DIR = os.path.join(args.dir, args.name)
     if not os.path.isdir(DIR):
@@ -76,7 +120,7 @@ def main():
         raise FileNotFoundError('Directory \"{}\" does not exist! Please download data from GCS'.\
                 format(CSV_DIR))
     
-    PKL_DIR = os.path.join(DIR, 'pkl')
+    PKL_DIR = os.path.join(DIR, args.format)
     if not os.path.isdir(PKL_DIR):
         os.makedirs(PKL_DIR)
 
@@ -86,60 +130,76 @@ def main():
     CSV_FILES = list(sorted(CSV_FILES))
     N_FILES = len(CSV_FILES)
     
-    df = pd.read_csv(os.path.join(CSV_DIR, CSV_FILES[0]), nrows=1, parse_dates=['block_date'])
-    first_date = df['block_date'].iloc[0]
-    del df
+    CSV_PATHS = [os.path.join(CSV_DIR, file_) for file_ in CSV_FILES]
+    FIRST_DAY, LAST_DAY = first_and_last_days(CSV_PATHS)
     
+    # weeks end on the weekday of --end_date, the first one ending a week after the start date, which is
+    # the first such weekday after the first date
     END_WEEKDAY = datetime.datetime.strptime(args.end_date, '%Y-%m-%d').weekday()
-    DELTA = datetime.timedelta(weeks=1)
-    
-    days_ahead = END_WEEKDAY - first_date.weekday()
-    if days_ahead <= 0:
-        days_ahead += 7
-    START_DATE = first_date + datetime.timedelta(days_ahead)
-    assert START_DATE.weekday() == END_WEEKDAY
+    START_DAY = period_ends(FIRST_DAY + 1, FIRST_DAY + 7, 'weekly', END_WEEKDAY)[0]
+    BOUNDARIES = period_ends(START_DAY + 1, LAST_DAY, 'weekly', END_WEEKDAY)
     print('Use \"{}\" as start_date for calc_top_holders.py'.\
-            format(datetime.datetime.strftime(START_DATE, '%Y-%m-%d')))
+            format(from_day(START_DAY).strftime('%Y-%m-%d')))
     
-    date = START_DATE + DELTA
     csv_rows_counter = 0
     pkl_rows_counter = 0
     week_counter = 0
-    to_save_df = pd.DataFrame()
+    to_save_dfs = []
+    address_index = AddressIndex()
+
+    def save(week, df):
+        if args.format == 'pkl':
+            df.to_pickle(os.path.join(PKL_DIR, '{:04d}.pkl'.format(week)))
+        else:
+            save_week(PKL_DIR, week, address_index.intern(df['address'].to_numpy()),
+                    df['value'].to_numpy())
     
     print('Converting data for \"{}\"...'.format(args.name))
     start = time()
-    for i, file_ in enumerate(CSV_FILES):
+    shards = prefetch(read_shard, CSV_PATHS, workers=args.prefetch) if args.prefetch else \
+            (df for fname in CSV_PATHS for df in read_shard(fname))
+    for i, (fname, (days, df)) in enumerate(zip(CSV_PATHS, stats.iterate('parse', shards))):
         if args.verbose:
             print(' file {} out of {}'.format(i, N_FILES - 1), end='\r')
     
-        fname = os.path.join(CSV_DIR, file_)
-        df = pd.read_csv(fname, dtype={'value': float}, parse_dates=['block_date'])
         csv_rows_counter += df.shape[0]
         
-        to_save_df = pd.concat([to_save_df, df[df['block_date'] <= date][['address', 'value']]])
-        remain_df = df[df['block_date'] > date]
-    
-        while not remain_df.empty:
-            to_save_df.to_pickle(os.path.join(PKL_DIR, '{:04d}.pkl'.format(week_counter)))
+        # rows are sorted by date, hence all weeks completed within the file are found at once and saved
+        # as slices of it; only a week spanning several files needs to be concatenated
+        begin = 0
+        for end in stats.iterate('split', split_periods(days, BOUNDARIES[week_counter:])):
+            with stats.stage('concat'):
+                to_save_df = pd.concat(to_save_dfs + [df.iloc[begin:end]]) if to_save_dfs else \
+                        df.iloc[begin:end]
+            with stats.stage('write'):
+                save(week_counter, to_save_df)
+            stats.period(from_day(BOUNDARIES[week_counter]).strftime('%Y-%m-%d'), to_save_df.shape[0])
             pkl_rows_counter += to_save_df.shape[0]
             week_counter += 1
-            date += DELTA
-    
-            df = remain_df
-            to_save_df = df[df['block_date'] <= date][['address', 'value']]
-            remain_df = df[df['block_date'] > date]
+            to_save_dfs = []
+            begin = end
+        to_save_dfs.append(df.iloc[begin:])
     
         if args.rm:
             os.remove(fname)
     
-    to_save_df.to_pickle(os.path.join(PKL_DIR, '{:04d}.pkl'.format(week_counter)))
+    with stats.stage('concat'):
+        to_save_df = pd.concat(to_save_dfs)
+    with stats.stage('write'):
+        save(week_counter, to_save_df)
+    stats.period(None, to_save_df.shape[0])
     pkl_rows_counter += to_save_df.shape[0]
     assert pkl_rows_counter == csv_rows_counter
+    with stats.stage('write'):
+        if args.format == 'npy':
+            save_addresses(PKL_DIR, address_index.addresses)
+    stats.close()
     
     print(' ' * 50, end='\r')
     print('Converting done!')
     print('Elapsed time: {:.4f} s'.format(time() - start))
+    if args.stats is not None:
+        print('Stats saved in {}'.format(args.stats))
 
 
 if __name__ == '__main__':
@@ -0,0 +1,262 @@
+#!/usr/bin/env python3.9
+
+# This script can be used to generate synthetic ERC20 token transfers in the layout of CSV files exported
+# by extract2csv.sql (or by extract2csv_exact.sql with --exact), so that the scripts of this repository
+# can be run and benchmarked without downloading data from GCS: each transfer is a pair of rows (the
+# receiver with a positive and the sender with a negative value), rows are sorted by date and split into
+# shards, and the activity of holders follows Zipf's law (a few holders take part in most transfers).
+# With --transfers, the same transfers are saved in the layout of extract2csv_transfers.sql instead, one
+# row per transfer with its raw amount, and with --tokens, in the layout of extract2csv_tokens.sql, each
+# transfer being of a random token listed in a file of tokens.
+
+import os
+import argparse
+import datetime
+import numpy as np
+import pandas as pd
+from time import time
+from transfers import load_tokens
+
+# tokens are minted by transfers from the null address, as on Ethereum
+NULL_ADDRESS = '0x' + '0' * 40
+# amounts are multiples of 10^-AMOUNT_DECIMALS tokens, which float and exact CSV files represent equally
+AMOUNT_DECIMALS = 6
+
+
+def random_addresses(holders, rng):
+    digits = rng.bytes(20 * holders).hex()
+    return np.array(['0x' + digits[40*i:40*(i+1)] for i in range(holders)])
+
+
+# generates about rows rows (or transfers_per_day transfers a day) of transfers between holders during
+# days days since start_date, which are saved in CSV files of shard_rows rows in csv_dir (one row per
+# transfer if transfers is set, hence half as many, or with a random one of tokens, see load_tokens(),
+# if they are given); returns the number of rows and the dates of the first and the last rows
+def generate(csv_dir, rows=None, days=365, holders=100000, transfers_per_day=None, zipf=1.1, mint=0.05,
+        start_date='2020-01-01', shard_rows=1000000, exact=False, decimals=18, seed=0, transfers=False,
+        tokens=None):
+    if transfers_per_day is None:
+        if rows is None:
+            raise ValueError('Either the number of rows or of transfers a day has to be given!')
+        transfers_per_day = rows / 2 / days
+    if (exact or transfers) and decimals < AMOUNT_DECIMALS or tokens is not None and \
+            (tokens['decimals'] < AMOUNT_DECIMALS).any():
+        raise ValueError('Decimals have to be at least {} with exact amounts!'.format(AMOUNT_DECIMALS))
+    if tokens is not None:
+        # trailing zeros of raw amounts of each token
+        zeros = np.array(['0' * (d - AMOUNT_DECIMALS) for d in tokens['decimals']])
+    if not os.path.isdir(csv_dir):
+        os.makedirs(csv_dir)
+
+    rng = np.random.default_rng(seed)
+    addresses = random_addresses(holders, rng)
+    # a holder of rank r (a random permutation of holders) takes part in a transfer with probability
+    # proportional to 1 / r^zipf
+    cdf = np.cumsum(1 / np.arange(1, holders + 1) ** zipf)
+    cdf /= cdf[-1]
+    ranks = rng.permutation(holders)
+    start = datetime.datetime.strptime(start_date, '%Y-%m-%d')
+
+    first_date = None
+    buffer = []
+    buffered = 0
+    shard = 0
+    total = 0
+
+    def save(df):
+        df.to_csv(os.path.join(csv_dir, '{:012d}.csv'.format(shard)), index=False)
+
+    for day in range(days):
+        n = rng.poisson(transfers_per_day)
+        if not n:
+            continue
+        date = (start + datetime.timedelta(days=day)).strftime('%Y-%m-%d')
+        if first_date is None:
+            first_date = date
+        senders = addresses[ranks[np.minimum(np.searchsorted(cdf, rng.random(n)), holders - 1)]]
+        senders[rng.random(n) < mint] = NULL_ADDRESS
+        receivers = addresses[ranks[np.minimum(np.searchsorted(cdf, rng.random(n)), holders - 1)]]
+
+        # log-normally distributed amounts in units of 10^-AMOUNT_DECIMALS tokens
+        units = np.maximum(np.rint(rng.lognormal(np.log(100), 2.5, n) * 10 ** AMOUNT_DECIMALS), 1)
+        raw = np.char.add(units.astype(np.int64).astype(str), '0' * (decimals - AMOUNT_DECIMALS))
+        if tokens is not None:
+            token = rng.integers(len(tokens), size=n)
+            df = pd.DataFrame({
+                'block_date': date,
+                'token_address': tokens.index[token],
+                'from_address': senders,
+                'to_address': receivers,
+                'value': np.char.add(units.astype(np.int64).astype(str), zeros[token]),
+                })
+        elif transfers:
+            df = pd.DataFrame({
+                'block_date': date,
+                'from_address': senders,
+                'to_address': receivers,
+                'value': raw,
+                })
+        else:
+            if exact:
+                values = np.column_stack([raw, np.char.add('-', raw)]).ravel()
+            else:
+                amounts = units / 10 ** AMOUNT_DECIMALS
+                values = np.column_stack([amounts, -amounts]).ravel()
+            df = pd.DataFrame({
+                'block_date': date,
+                'address': np.column_stack([receivers, senders]).ravel(),
+                'value': values,
+                })
+
+        buffer.append(df)
+        buffered += len(df)
+        while buffered >= shard_rows:
+            df = pd.concat(buffer, ignore_index=True)
+            save(df.iloc[:shard_rows])
+            buffer = [df.iloc[shard_rows:]]
+            buffered -= shard_rows
+            total += shard_rows
+            shard += 1
+
+    if buffered:
+        save(pd.concat(buffer, ignore_index=True))
+        total += buffered
+    if not total:
+        raise ValueError('No transfers were generated! Please increase the number of rows')
+    return total, first_date, date
+
+
+def main():
+    formatter = lambda prog: argparse.RawTextHelpFormatter(prog, max_help_position=50)
+    parser = argparse.ArgumentParser(
+            description='Generates synthetic ERC20 token transfers in the layout of CSV files exported\n'
+                'by extract2csv.sql',
+            add_help=False,
+            formatter_class=formatter,
+            )
+
+    # required arguments
+    required_args = parser.add_argument_group('required arguments')
+    required_args.add_argument(
+            '--dir',
+            type=str,
+            required=True,
+            help='Path to parent directory with ERC20 tokens data',
+            )
+    required_args.add_argument(
+            '--name',
+            type=str,
+            required=True,
+            help='Name of ERC20 token (CSV files are saved in its folder \"csv\")',
+            )
+
+    # optimal arguments
+    optional_args = parser.add_argument_group('optional arguments')
+    optional_args.add_argument(
+            '-h',
+            '--help',
+            action='help',
+            help='show this help message and exit',
+            )
+    optional_args.add_argument(
+            '--rows',
+            type=int,
+            default=1000000,
+            help='Approximate number of rows in the layout of extract2csv.sql (two per transfer),\n'
+                'defaults to 1000000',
+            )
+    optional_args.add_argument(
+            '--transfers_per_day',
+            type=float,
+            default=None,
+            help='Average number of transfers a day, which overrides --rows if given',
+            )
+    optional_args.add_argument(
+            '--days',
+            type=int,
+            default=365,
+            help='Age of token in days, defaults to 365',
+            )
+    optional_args.add_argument(
+            '--holders',
+            type=int,
+            default=100000,
+            help='Number of holders, defaults to 100000',
+            )
+    optional_args.add_argument(
+            '--zipf',
+            type=float,
+            default=1.1,
+            help='Exponent of Zipf\'s law of holder activity, defaults to 1.1',
+            )
+    optional_args.add_argument(
+            '--mint',
+            type=float,
+            default=0.05,
+            help='Fraction of transfers minting tokens (sent by the null address), defaults to 0.05',
+            )
+    optional_args.add_argument(
+            '--start_date',
+            type=str,
+            default='2020-01-01',
+            help='Date of the first transfers in format YYYY-MM-DD, defaults to 2020-01-01',
+            )
+    optional_args.add_argument(
+            '--shard_rows',
+            type=int,
+            default=1000000,
+            help='Number of rows in a CSV file, defaults to 1000000',
+            )
+    optional_args.add_argument(
+            '--exact',
+            action='store_true',
+            default=False,
+            help='Save raw integer token amounts (as extract2csv_exact.sql), defaults to False'
+            )
+    optional_args.add_argument(
+            '--transfers',
+            action='store_true',
+            default=False,
+            help='Save one row per transfer with its raw amount (as extract2csv_transfers.sql),\n'
+                'the same transfers (for the same seed) taking half as many rows, defaults to False'
+            )
+    optional_args.add_argument(
+            '--tokens',
+            type=str,
+            default=None,
+            help='CSV file of tokens (with columns token_address, name and decimals) to save\n'
+                'transfers of, each of a random one, as extract2csv_tokens.sql, defaults to None',
+            )
+    optional_args.add_argument(
+            '--decimals',
+            type=int,
+            default=18,
+            help='Decimals of ERC20 token used for raw amounts with --exact or --transfers,\n'
+                'defaults to 18',
+            )
+    optional_args.add_argument(
+            '--seed',
+            type=int,
+            default=0,
+            help='Seed of random number generator, defaults to 0',
+            )
+    args = parser.parse_args()
+
+    CSV_DIR = os.path.join(args.dir, args.name, 'csv')
+    if os.path.isdir(CSV_DIR) and os.listdir(CSV_DIR):
+        raise ValueError('Directory \"{}\" is not empty! Please remove it first'.format(CSV_DIR))
+
+    print('Generating transfers for \"{}\"...'.format(args.name))
+    start = time()
+    rows, first_date, last_date = generate(CSV_DIR, rows=args.rows, days=args.days, holders=args.holders,
+            transfers_per_day=args.transfers_per_day, zipf=args.zipf, mint=args.mint,
+            start_date=args.start_date, shard_rows=args.shard_rows, exact=args.exact,
+            decimals=args.decimals, seed=args.seed, transfers=args.transfers,
+            tokens=load_tokens(args.tokens) if args.tokens is not None else None)
+    print('Generated {} rows since \'{}\' until \'{}\' including.'.format(rows, first_date, last_date))
+    print('Elapsed time: {:.4f} s'.format(time() - start))
+    print('Data saved in {}'.format(CSV_DIR))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,261 @@
+#!/usr/bin/env python3.9
+
+# This module contains helpers to read CSV files of ERC20 token transfers (downloaded from GCS) chunk by
+# chunk, so that memory usage is bounded by the chunk size rather than by the size of CSV files, and to
+# save/load weekly transfers in a columnar format.
+
+import os
+import queue
+import threading
+import datetime
+from io import StringIO
+from collections import deque
+import numpy as np
+import pandas as pd
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
+
+EPOCH = datetime.datetime(1970, 1, 1)
+CADENCES = ['daily', 'weekly', 'monthly', 'days']
+WEEKDAYS = ['monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday', 'sunday']
+# columns of CSV files exported by extract2csv_transfers.sql, one row per transfer with its raw amount
+TRANSFER_COLUMNS = ['block_date', 'from_address', 'to_address', 'value']
+# columns of CSV files exported by extract2csv_tokens.sql, transfers of several tokens
+TOKEN_TRANSFER_COLUMNS = ['block_date', 'token_address', 'from_address', 'to_address', 'value']
+# columns of the file of tokens to be processed in CSV files exported by extract2csv_tokens.sql
+TOKEN_COLUMNS = ['token_address', 'name', 'decimals']
+
+
+# converts a date to the number of days since EPOCH, which is used as a compact integer day index
+def to_day(date):
+    return (date - EPOCH).days
+
+
+def from_day(day):
+    return EPOCH + datetime.timedelta(days=int(day))
+
+
+# converts a column of dates in format YYYY-MM-DD to day indices; there are only a few distinct dates in
+# a chunk, hence each of them is parsed only once
+def parse_days(dates):
+    codes, uniques = pd.factorize(np.asarray(dates))
+    days = pd.to_datetime(uniques, format='%Y-%m-%d').values.astype('datetime64[D]').astype(np.int32)
+    return days[codes]
+
+
+# returns days of the first and the last rows in CSV files sorted by date
+def first_and_last_days(files):
+    df = pd.read_csv(files[0], nrows=1, dtype=str)
+    with open(files[-1], 'r') as f:
+        q = deque(f, 1)
+    df = pd.concat([df, pd.read_csv(StringIO(''.join(q)), names=df.columns, dtype=str)])
+    first_day, last_day = parse_days(df['block_date'])
+    return int(first_day), int(last_day)
+
+
+# returns days in [first_day, last_day] ending periods of the given cadence: every day for 'daily', the
+# given weekday (0 is Monday) for 'weekly', the last day of a month for 'monthly', and every `every` days
+# since first_day for 'days'
+def period_ends(first_day, last_day, cadence='weekly', weekday=6, every=7):
+    days = np.arange(first_day, last_day + 1)
+    if cadence == 'daily':
+        return days
+    if cadence == 'weekly':
+        return days[(days + EPOCH.weekday()) % 7 == weekday]
+    if cadence == 'monthly':
+        next_days = (days + 1).astype('datetime64[D]')
+        return days[next_days == next_days.astype('datetime64[M]').astype('datetime64[D]')]
+    if cadence == 'days':
+        return days[(days - first_day) % every == 0]
+    raise ValueError('Unknown cadence \"{}\"! Available cadences: {}'.format(cadence, ', '.join(CADENCES)))
+
+
+# returns offsets splitting a chunk of rows, sorted by their days, by the given (sorted) period ends: rows
+# offsets[i-1]:offsets[i] are the ones until boundaries[i]; only the periods which end before the last row
+# of the chunk (i.e., are complete) are considered
+def split_periods(days, boundaries):
+    if not len(days):
+        return np.zeros(0, dtype=np.int64)
+    boundaries = boundaries[:np.searchsorted(boundaries, days[-1], side='left')]
+    return np.searchsorted(days, boundaries, side='right')
+
+
+# yields (days, addresses, values) arrays of at most chunksize rows read from a CSV file; values are raw
+# strings if exact is set and floats otherwise
+def read_chunks(fname, chunksize=1000000, exact=False):
+    chunks = pd.read_csv(
+            fname,
+            usecols=['block_date', 'address', 'value'],
+            dtype={'block_date': str, 'address': str, 'value': str if exact else float},
+            chunksize=chunksize,
+            )
+    for chunk in chunks:
+        # rows without an address are skipped, as sides of transfers are by transfer_sides()
+        chunk = chunk[chunk['address'].notna()]
+        yield parse_days(chunk['block_date']), chunk['address'].to_numpy(), chunk['value'].to_numpy()
+
+
+# returns whether a CSV file has one row per transfer (see TRANSFER_COLUMNS) rather than one per side
+def is_transfer_file(fname):
+    return 'from_address' in pd.read_csv(fname, nrows=0).columns
+
+
+# returns whether a CSV file has transfers of several tokens (see TOKEN_TRANSFER_COLUMNS)
+def is_token_file(fname):
+    return 'token_address' in pd.read_csv(fname, nrows=0).columns
+
+
+# returns rows, addresses and raw amounts of both sides of the transfers in a chunk with one row per
+# transfer, interleaved into one array: the receiver is credited before the sender is debited as in
+# files exported by extract2csv.sql, so that they are applied by one vectorized update with the same
+# result; sides without an address are skipped
+def transfer_sides(chunk, exact=False):
+    addresses = np.column_stack([chunk['to_address'].to_numpy(),
+        chunk['from_address'].to_numpy()]).ravel()
+    value = chunk['value'].to_numpy()
+    if exact:
+        value = value.astype(str)
+        values = np.column_stack([value, np.char.add('-', value)]).ravel()
+    else:
+        values = np.column_stack([value, -value]).ravel()
+    valid = np.flatnonzero(pd.notna(addresses))
+    return valid // 2, addresses[valid], values[valid]
+
+
+# yields chunks of a CSV file with one row per transfer in the same form as read_chunks() (see
+# transfer_sides()); raw amounts are divided by 10^decimals unless exact is set
+def read_transfer_chunks(fname, chunksize=1000000, exact=False, decimals=18):
+    chunks = pd.read_csv(
+            fname,
+            usecols=TRANSFER_COLUMNS,
+            dtype={'block_date': str, 'from_address': str, 'to_address': str,
+                'value': str if exact else float},
+            chunksize=chunksize,
+            )
+    for chunk in chunks:
+        rows, addresses, values = transfer_sides(chunk, exact)
+        yield parse_days(chunk['block_date'])[rows], addresses, values if exact else \
+                values / 10 ** decimals
+
+
+# returns tokens (names and decimals indexed by lower case token addresses) listed in a CSV file with
+# columns TOKEN_COLUMNS
+def load_tokens(fname):
+    tokens = pd.read_csv(fname, dtype={'token_address': str, 'name': str, 'decimals': int})
+    missing = [column for column in TOKEN_COLUMNS if column not in tokens]
+    if missing:
+        raise ValueError('File \"{}\" has no columns {}!'.format(fname, ', '.join(missing)))
+    tokens['token_address'] = tokens['token_address'].str.lower()
+    for column in ['token_address', 'name']:
+        if tokens[column].duplicated().any():
+            raise ValueError('File \"{}\" lists token {} \"{}\" more than once!'.format(fname,
+                column.split('_')[-1], tokens[column][tokens[column].duplicated()].iloc[0]))
+    return tokens.set_index('token_address')[['name', 'decimals']]
+
+
+# yields (days, token IDs, addresses, values) of both sides of transfers of the tokens (a dictionary of
+# IDs by lower case token addresses) read from a CSV file exported by extract2csv_tokens.sql, in chunks
+# of at most chunksize transfers; values are raw amounts (strings if exact is set and floats otherwise)
+# and transfers of other tokens are skipped
+def read_token_chunks(fname, tokens, chunksize=1000000, exact=False):
+    chunks = pd.read_csv(
+            fname,
+            usecols=TOKEN_TRANSFER_COLUMNS,
+            dtype={'block_date': str, 'token_address': str, 'from_address': str, 'to_address': str,
+                'value': str if exact else float},
+            chunksize=chunksize,
+            )
+    for chunk in chunks:
+        # the dictionary is only queried once per token in a chunk
+        codes, uniques = pd.factorize(chunk['token_address'].str.lower())
+        token_ids = np.array([tokens.get(token, -1) for token in uniques] + [-1], dtype=np.int64)[codes]
+        listed = np.flatnonzero(token_ids >= 0)
+        chunk = chunk.iloc[listed]
+        rows, addresses, values = transfer_sides(chunk, exact)
+        yield parse_days(chunk['block_date'])[rows], token_ids[listed][rows], addresses, values
+
+
+# yields what read (a generator function) yields for each of the files, in order of the files, while a
+# pool of worker threads reads the next files in the background (the C parser of pandas releases the
+# GIL); each file has its own queue of at most depth items, hence memory usage stays bounded
+def prefetch(read, files, workers=1, depth=2):
+    queues = [queue.Queue(maxsize=depth) for _ in files]
+    stop = threading.Event()
+    done = object()
+
+    # returns False if the consumer has stopped, so that a worker never blocks forever on a full queue
+    def put(q, item):
+        while not stop.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def produce(fname, q):
+        try:
+            for item in read(fname):
+                if not put(q, item):
+                    return
+        except Exception as e:
+            put(q, e)
+        put(q, done)
+
+    # files are started in order, hence the file being consumed is always read by some worker
+    executor = ThreadPoolExecutor(max_workers=workers)
+    try:
+        for fname, q in zip(files, queues):
+            executor.submit(produce, fname, q)
+        for q in queues:
+            while (item := q.get()) is not done:
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+    finally:
+        stop.set()
+        executor.shutdown(cancel_futures=True)
+
+
+# yields chunks of the files in order (see read_chunks and, if transfers is set, read_transfer_chunks, or
+# read_token_chunks if tokens are given), the next ones being read by worker threads in the background
+# unless workers is 0
+def read_transfers(files, chunksize=1000000, exact=False, workers=0, transfers=False, decimals=18,
+        tokens=None):
+    read = partial(read_transfer_chunks, decimals=decimals) if transfers else read_chunks
+    if tokens is not None:
+        read = partial(read_token_chunks, tokens=tokens)
+    read = partial(read, chunksize=chunksize, exact=exact)
+    if not workers:
+        for fname in files:
+            yield from read(fname)
+    else:
+        yield from prefetch(read, files, workers=workers)
+
+
+# weekly data can be saved in a columnar format instead of pickle: address IDs and values of a week are
+# saved as contiguous arrays in {week:04d}_ids.npy and {week:04d}_values.npy, while addresses.npy maps
+# IDs to addresses (IDs being assigned in order of the first appearance), so that weeks can be memory
+# mapped instead of being deserialized
+def save_week(dir_, week, ids, values):
+    np.save(os.path.join(dir_, '{:04d}_ids.npy'.format(week)), np.asarray(ids, dtype=np.int32))
+    np.save(os.path.join(dir_, '{:04d}_values.npy'.format(week)), np.asarray(values, dtype=float))
+
+
+def load_week(dir_, week):
+    return np.load(os.path.join(dir_, '{:04d}_ids.npy'.format(week)), mmap_mode='r'), \
+            np.load(os.path.join(dir_, '{:04d}_values.npy'.format(week)), mmap_mode='r')
+
+
+def count_weeks(dir_):
+    return len([f for f in os.listdir(dir_) if f.endswith('_values.npy')])
+
+
+def save_addresses(dir_, addresses):
+    np.save(os.path.join(dir_, 'addresses.npy'), np.array(addresses, dtype='S'))
+
+
+# returns addresses as a memory mapped array of raw bytes, which have to be formatted as strings for
+# output (see format_addresses() in balances.py)
+def load_addresses(dir_):
+    return np.load(os.path.join(dir_, 'addresses.npy'), mmap_mode='r')